@@ -0,0 +1,254 @@
+# audio_preview.py
+# -----------------------------------------------------------
+# Offline Ranad audio preview (no soundfont / audio device)
+# Includes:
+# - same sequence strings + timing as generate_ranad_midi
+#   (octave pairs, กรอ rolls, THAI_BASE tuning)
+# - struck-bar (marimba-like) synthesis with NumPy:
+#   precomputed decaying partial tables, added for all strikes
+#   at once into one preallocated buffer
+# - WAV export (stdlib wave) + parallel batch rendering
+# -----------------------------------------------------------
+
+import re
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .midi_ranad import THAI_BASE, OCTAVE_OFFSET
+
+TICKS_PER_BEAT = 480
+TICKS_PER_SLOT = 240
+
+# struck wooden bar: inharmonic partials, upper ones die out faster
+PARTIAL_RATIOS = np.array([1.0, 3.93, 9.54])
+PARTIAL_GAINS = np.array([1.0, 0.32, 0.10])
+PARTIAL_DECAYS = np.array([5.0, 13.0, 32.0])   # 1/s
+
+_table_cache = {}
+
+
+# -----------------------------------------------------------
+# 1) Sequence → strikes (mirrors generate_ranad_midi)
+# -----------------------------------------------------------
+def ranad_strikes(
+    sequence,
+    bpm=150,
+    global_transpose=12,
+    play_in_octave_pairs=True,
+    enable_roll=True,
+    seed=None
+):
+    """
+    sequence: string of Thai notes with octave digits (e.g. ด3ร2ม2-)
+
+    Returns (onset_seconds, midi_pitch, velocity, total_seconds);
+    one entry per mallet strike, with the same tick layout that
+    generate_ranad_midi writes to the .mid file.
+    """
+    rng = np.random.default_rng(seed)
+    breath_gap = TICKS_PER_SLOT // 8
+    note_pattern = re.compile(r'([ดรมฟซลท])(\d)?')
+
+    onsets, pitches_out, vels = [], [], []
+
+    now = 0        # absolute tick of the last written MIDI event
+    cursor = 0     # pending delta before the next event
+    last_end = 0
+
+    for match in re.finditer(note_pattern, sequence):
+        symbol, octave_tag = match.groups()
+
+        cursor += sequence[last_end:match.start()].count('-') * TICKS_PER_SLOT
+
+        octave = int(octave_tag) if octave_tag else 2
+        main_pitch = THAI_BASE[symbol] + OCTAVE_OFFSET[octave] + global_transpose
+
+        pitches = [main_pitch]
+        if play_in_octave_pairs:
+            pitches = sorted({main_pitch, main_pitch - 12})
+
+        j = match.end()
+        dash_count = 0
+        while j < len(sequence) and sequence[j] == '-':
+            dash_count += 1
+            j += 1
+
+        # กรอ: alternating strikes, note_on / note_off every roll_step
+        if enable_roll and dash_count >= 2:
+            roll_step = TICKS_PER_SLOT // 4
+            elapsed = 0
+            toggle = 0
+
+            while elapsed < TICKS_PER_SLOT:
+                t = cursor if elapsed == 0 else roll_step
+                now += t
+                onsets.append(now)
+                pitches_out.append(pitches[toggle % len(pitches)])
+                vels.append(rng.choice([76, 80, 84]))
+                now += roll_step
+
+                cursor = 0
+                elapsed += roll_step
+                toggle += 1
+
+            cursor += (dash_count - 1) * TICKS_PER_SLOT + breath_gap
+            last_end = j
+            continue
+
+        now += cursor
+        for p in pitches:
+            onsets.append(now)
+            pitches_out.append(p)
+            vels.append(80)
+        now += TICKS_PER_SLOT
+
+        cursor = dash_count * TICKS_PER_SLOT
+        last_end = j
+
+    cursor += sequence[last_end:].count('-') * TICKS_PER_SLOT
+
+    sec_per_tick = 60.0 / (bpm * TICKS_PER_BEAT)
+    return (
+        np.array(onsets, dtype=np.float64) * sec_per_tick,
+        np.array(pitches_out, dtype=np.int64),
+        np.array(vels, dtype=np.float64),
+        (now + cursor) * sec_per_tick,
+    )
+
+
+# -----------------------------------------------------------
+# 2) Partial tables
+# -----------------------------------------------------------
+def _strike_tables(pitches, sample_rate, tail):
+    """
+    (len(pitches) × n) waveforms of one full-velocity strike per pitch.
+    Cached per (pitch, sample_rate, tail).
+    """
+    n = int(tail * sample_rate)
+    missing = [p for p in pitches if (p, sample_rate, tail) not in _table_cache]
+
+    if missing:
+        t = np.arange(n) / sample_rate
+        f0 = 440.0 * 2.0 ** ((np.array(missing)[:, None, None] - 69) / 12.0)
+        freqs = f0 * PARTIAL_RATIOS[None, :, None]
+
+        # partials above Nyquist are dropped instead of aliasing
+        gains = PARTIAL_GAINS[None, :, None] * (freqs < sample_rate / 2)
+        env = np.exp(-PARTIAL_DECAYS[None, :, None] * t)
+        tables = (gains * env * np.sin(2 * np.pi * freqs * t)).sum(axis=1)
+
+        # 2 ms attack ramp avoids a click at the onset
+        attack = min(n, int(0.002 * sample_rate))
+        tables[:, :attack] *= np.linspace(0.0, 1.0, attack, endpoint=False)
+
+        for p, table in zip(missing, tables.astype(np.float32)):
+            _table_cache[p, sample_rate, tail] = table
+
+    return np.stack([_table_cache[p, sample_rate, tail] for p in pitches])
+
+
+# -----------------------------------------------------------
+# 3) Render
+# -----------------------------------------------------------
+def render_ranad_audio(
+    sequence,
+    sample_rate=22050,
+    bpm=150,
+    global_transpose=12,
+    play_in_octave_pairs=True,
+    enable_roll=True,
+    tail=0.8,
+    normalize=True,
+    seed=None,
+    chunk_strikes=512
+):
+    """
+    Synthesize a mono float32 waveform for a ranad sequence string.
+
+    tail:          seconds each strike rings before it is cut
+    normalize:     scale the peak to 0.9 (otherwise fixed gain)
+    chunk_strikes: strikes added per vectorized step (bounds memory)
+    """
+    onsets, pitches, vels, total = ranad_strikes(
+        sequence, bpm, global_transpose, play_in_octave_pairs, enable_roll, seed
+    )
+
+    table_len = int(tail * sample_rate)
+    n_samples = int(np.ceil(total * sample_rate)) + table_len
+    buffer = np.zeros(n_samples, dtype=np.float64)
+
+    if len(onsets) == 0:
+        return buffer.astype(np.float32)
+
+    unique_pitches, pitch_idx = np.unique(pitches, return_inverse=True)
+    tables = _strike_tables(unique_pitches.tolist(), sample_rate, tail)
+
+    starts = np.round(onsets * sample_rate).astype(np.int64)
+    offsets = np.arange(table_len, dtype=np.int64)
+    gains = vels / 127.0
+
+    # bincount sums overlapping strikes correctly (unlike buffer[idx] += …)
+    for lo in range(0, len(starts), chunk_strikes):
+        sl = slice(lo, lo + chunk_strikes)
+        idx = (starts[sl, None] + offsets[None, :]).ravel()
+        vals = (gains[sl, None] * tables[pitch_idx[sl]]).ravel()
+        buffer += np.bincount(idx, weights=vals, minlength=n_samples)
+
+    if normalize:
+        peak = np.abs(buffer).max()
+        if peak > 0:
+            buffer *= 0.9 / peak
+    else:
+        buffer *= 0.25
+
+    return np.clip(buffer, -1.0, 1.0).astype(np.float32)
+
+
+def write_wav(path, audio, sample_rate=22050):
+    """Write mono float audio in [-1, 1] as 16-bit PCM WAV."""
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+    return path
+
+
+def render_ranad_wav(sequence, output_path, sample_rate=22050, **kwargs):
+    """
+    WAV counterpart of generate_ranad_midi (same sequence + keyword args).
+    """
+    audio = render_ranad_audio(sequence, sample_rate=sample_rate, **kwargs)
+    return write_wav(output_path, audio, sample_rate)
+
+
+def _render_job(args):
+    sequence, output_path, kwargs = args
+    render_ranad_wav(sequence, output_path, **kwargs)
+    return str(output_path)
+
+
+def render_many(sequences, output_paths, workers=None, **kwargs):
+    """
+    Render many sequences to WAV in parallel worker processes.
+
+    sequences:    list of sequence strings
+    output_paths: matching list of .wav paths
+    workers:      process count (default: os.cpu_count())
+    """
+    if len(sequences) != len(output_paths):
+        raise ValueError("sequences and output_paths must have the same length")
+
+    for p in output_paths:
+        Path(p).parent.mkdir(parents=True, exist_ok=True)
+
+    jobs = [(seq, out, kwargs) for seq, out in zip(sequences, output_paths)]
+    if workers == 1:
+        return [_render_job(j) for j in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_job, jobs))
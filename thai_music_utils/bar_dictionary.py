@@ -0,0 +1,282 @@
+# bar_dictionary.py
+# -----------------------------------------------------------
+# Corpus-wide dictionary of distinct bars
+#
+# Every bar of every song is hashed once and given a bar ID; songs are then
+# stored as per-section sequences of bar IDs. Two keying levels:
+# - tokens : normalized token tuple (what the n-gram / LSTM models see,
+#            octave marks dropped) — decodes back to pitch_sequence
+# - slots  : the bar exactly as written in the JSON (octave marks, นำ/ตาม
+#            blocks) — decodes back to the section bars
+#
+# On top of that:
+# - duplication reports per song and per motif (เถา songs repeat bars
+#   across สามชั้น / สองชั้น / ชั้นเดียว and across เที่ยวแรก / เที่ยวกลับ)
+# - LSTM training windows with exact dedup and count weights, so repeated
+#   passages do not dominate an epoch
+#
+# Usage:
+#   python3 -m thai_music_utils.bar_dictionary
+#   python3 -m thai_music_utils.bar_dictionary --motif เขมร --seq-len 32 --save
+# -----------------------------------------------------------
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+from .corpus import _bar_tokens, build_vocab, load_songs
+
+LEVELS = ("tokens", "slots")
+DEFAULT_DICT_PATH = Path(__file__).parent.parent / "thai_music_data" / "index" / "bar_dictionary.json"
+
+
+# -----------------------------------------------------------
+# 1) Dictionary
+# -----------------------------------------------------------
+def bar_tokens(bar):
+    """Normalized token tuple of one JSON bar (list or นำ/ตาม dict)."""
+    tokens = []
+    _bar_tokens(bar, tokens)
+    return tuple(tokens)
+
+
+def _bar_key(bar, level):
+    if level == "tokens":
+        return bar_tokens(bar)
+    return json.dumps(bar, ensure_ascii=False, sort_keys=True)
+
+
+def build_bar_dictionary(songs, level="tokens"):
+    """
+    songs: list of song dicts from corpus.load_songs()
+
+    Returns a dictionary dict:
+        level    "tokens" | "slots"
+        bars     bar per ID (token list, or the JSON bar for "slots")
+        tokens   normalized token list per ID
+        counts   occurrences of each ID over the whole corpus
+        songs    [{"motif", "song", "path", "sections": [{"name", "bar_ids"}]}]
+    Sections are the top-level ones song_to_pitch_sequence reads, so the
+    decoded tokens equal each song's pitch_sequence.
+    """
+    if level not in LEVELS:
+        raise ValueError(f"Unknown level: {level!r}")
+
+    ids, bars, tokens, counts = {}, [], [], []
+    out_songs = []
+
+    for s in songs:
+        sections = []
+        for section in s["data"].get("sections", []):
+            bar_ids = []
+            for bar in section.get("bars", []):
+                key = _bar_key(bar, level)
+                bar_id = ids.get(key)
+                if bar_id is None:
+                    bar_id = ids[key] = len(bars)
+                    bars.append(list(key) if level == "tokens" else bar)
+                    tokens.append(list(bar_tokens(bar)))
+                    counts.append(0)
+                counts[bar_id] += 1
+                bar_ids.append(bar_id)
+            sections.append({"name": section.get("name", ""), "bar_ids": bar_ids})
+
+        out_songs.append({
+            "motif": s["motif"],
+            "song": s["song"],
+            "path": s["path"],
+            "sections": sections,
+        })
+
+    return {
+        "level": level,
+        "bars": bars,
+        "tokens": tokens,
+        "counts": counts,
+        "songs": out_songs,
+    }
+
+
+def song_bar_ids(entry):
+    """Flat bar-ID sequence of one dictionary song entry."""
+    return [b for sec in entry["sections"] for b in sec["bar_ids"]]
+
+
+def decode_tokens(dictionary, bar_ids):
+    """Bar IDs → flat token sequence (pitch_sequence for a whole song)."""
+    tokens = dictionary["tokens"]
+    return [tok for b in bar_ids for tok in tokens[b]]
+
+
+def decode_bars(dictionary, bar_ids):
+    """Bar IDs → JSON bars (exact only for level="slots")."""
+    return [dictionary["bars"][b] for b in bar_ids]
+
+
+def save_dictionary(dictionary, path=DEFAULT_DICT_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dictionary, f, ensure_ascii=False, separators=(",", ":"))
+    return path
+
+
+def load_dictionary(path=DEFAULT_DICT_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# -----------------------------------------------------------
+# 2) Duplication reports
+# -----------------------------------------------------------
+def duplication_report(dictionary):
+    """
+    Per-song DataFrame:
+        bars, unique_bars      bar occurrences / distinct IDs in the song
+        dup_within             1 − unique_bars / bars
+        shared                 fraction of the song's bars whose ID also
+                               occurs in another song
+        tokens, unique_tokens  tokens in all bars / in the distinct bars
+    """
+    import pandas as pd
+
+    songs_of = {}
+    for i, entry in enumerate(dictionary["songs"]):
+        for b in set(song_bar_ids(entry)):
+            songs_of.setdefault(b, set()).add(i)
+
+    lengths = [len(t) for t in dictionary["tokens"]]
+    rows = []
+    for i, entry in enumerate(dictionary["songs"]):
+        ids = song_bar_ids(entry)
+        unique = set(ids)
+        rows.append({
+            "motif": entry["motif"],
+            "song": entry["song"],
+            "bars": len(ids),
+            "unique_bars": len(unique),
+            "dup_within": 1 - len(unique) / len(ids) if ids else 0.0,
+            "shared": sum(1 for b in ids if len(songs_of[b]) > 1) / len(ids) if ids else 0.0,
+            "tokens": sum(lengths[b] for b in ids),
+            "unique_tokens": sum(lengths[b] for b in unique),
+        })
+    return pd.DataFrame(rows)
+
+
+def motif_report(dictionary):
+    """
+    Per-motif DataFrame: bars, distinct bars over the motif, duplication
+    rate (1 − unique / bars) and the same for tokens.
+    """
+    import pandas as pd
+
+    lengths = [len(t) for t in dictionary["tokens"]]
+    by_motif = {}
+    for entry in dictionary["songs"]:
+        by_motif.setdefault(entry["motif"], []).extend(song_bar_ids(entry))
+
+    rows = []
+    for motif, ids in sorted(by_motif.items()):
+        unique = set(ids)
+        tokens = sum(lengths[b] for b in ids)
+        unique_tokens = sum(lengths[b] for b in unique)
+        rows.append({
+            "motif": motif,
+            "songs": sum(1 for e in dictionary["songs"] if e["motif"] == motif),
+            "bars": len(ids),
+            "unique_bars": len(unique),
+            "bar_dup_rate": 1 - len(unique) / len(ids) if ids else 0.0,
+            "tokens": tokens,
+            "unique_tokens": unique_tokens,
+            "token_dup_rate": 1 - unique_tokens / tokens if tokens else 0.0,
+        })
+    return pd.DataFrame(rows)
+
+
+# -----------------------------------------------------------
+# 3) Training windows
+# -----------------------------------------------------------
+def training_windows(sequences, token_to_id, seq_len=16, dedup=True):
+    """
+    LSTM (X, y) windows as in the notebooks: X[i] = ids[i:i+seq_len],
+    y[i] = ids[i+seq_len], per sequence (never across songs).
+
+    dedup=True collapses identical (X, y) pairs, kept in order of first
+    occurrence (so unshuffled epochs still walk the songs in order).
+    Returns (X, y, counts); counts[i] is how often row i occurred (all
+    ones without dedup).
+    Weighting each row's loss by counts gives exactly the full-corpus
+    loss in fewer forward passes (see window_weights).
+    """
+    rows = []
+    for seq in sequences:
+        ids = np.fromiter((token_to_id[t] for t in seq), dtype=np.int64, count=len(seq))
+        if len(ids) <= seq_len:
+            continue
+        rows.append(np.lib.stride_tricks.sliding_window_view(ids, seq_len + 1))
+
+    if not rows:
+        empty = np.zeros((0, seq_len), dtype=np.int64)
+        return empty, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    windows = np.concatenate(rows)
+    if dedup:
+        windows, first, counts = np.unique(windows, axis=0, return_index=True, return_counts=True)
+        order = np.argsort(first)
+        windows, counts = windows[order], counts[order]
+    else:
+        counts = np.ones(len(windows), dtype=np.int64)
+    return windows[:, :seq_len], windows[:, seq_len], counts
+
+
+def window_weights(counts, power=0.5):
+    """
+    Per-window weights counts ** power, scaled to mean 1.
+        power=1    full-corpus frequency (dedup is then lossless)
+        power=0    every distinct window counts once
+        0<power<1  repeated passages damped, not removed
+    Use as loss weights or WeightedRandomSampler weights.
+    """
+    w = np.asarray(counts, dtype=np.float64) ** power
+    return w * (len(w) / w.sum()) if len(w) else w
+
+
+# -----------------------------------------------------------
+# 4) CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Bar dictionary + duplication report.")
+    parser.add_argument("--motif", default=None, help="Only this motif (default: all)")
+    parser.add_argument("--level", default="tokens", choices=LEVELS)
+    parser.add_argument("--seq-len", type=int, default=16, help="LSTM window length")
+    parser.add_argument("--save", action="store_true", help=f"Write {DEFAULT_DICT_PATH.name}")
+    args = parser.parse_args()
+
+    root = Path(__file__).parent.parent
+    songs = load_songs(root / "thai_music_data", motif=args.motif)
+    dictionary = build_bar_dictionary(songs, level=args.level)
+
+    print(f"{sum(dictionary['counts'])} bars → {len(dictionary['bars'])} distinct ({args.level})\n")
+    print(motif_report(dictionary).round(3).to_string(index=False))
+
+    report = duplication_report(dictionary).sort_values("dup_within", ascending=False)
+    print("\nMost repetitive songs:")
+    print(report.head(10).round(3).to_string(index=False))
+
+    _, token_to_id, _ = build_vocab(songs)
+    seqs = [s["pitch_sequence"] for s in songs]
+    n_all = len(training_windows(seqs, token_to_id, args.seq_len, dedup=False)[1])
+    n_unique = len(training_windows(seqs, token_to_id, args.seq_len, dedup=True)[1])
+    if n_all:
+        print(f"\nseq_len={args.seq_len}: {n_all} training windows → {n_unique} distinct "
+              f"({1 - n_unique / n_all:.1%} fewer per epoch)")
+
+    if args.save:
+        path = save_dictionary(dictionary)
+        print(f"\n💾 {path}")
+
+
+if __name__ == "__main__":
+    main()
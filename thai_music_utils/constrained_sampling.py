@@ -0,0 +1,419 @@
+# constrained_sampling.py
+# -----------------------------------------------------------
+# Grammar-constrained sampling for the N-gram / LSTM generators
+# Tracks, while sampling:
+# - position inside the current 4-unit slot and 8-slot bar
+#   (pitch = 1 unit, <REST_k> = k units)
+# - the previous pitch, when octaves are assigned on the fly
+# Masks every token that would
+# - overflow the current slot (so no slot is chopped mid-rest
+#   by combine_fragment_and_generated and no bar ends mid-slot)
+# - follow a rest inside the same slot (normalize_token would
+#   have merged the two, so the corpus never contains it)
+# - have no octave in `allowed_oct` (optionally within max_leap)
+# Returns the usual token list plus ready-made slots and
+# masking statistics.
+# -----------------------------------------------------------
+
+import numpy as np
+
+from .constants import thai_base, octave_offset, LOW_DOT, HIGH_DOT
+from .corpus import normalize_token
+
+UNITS_PER_SLOT = 4
+SLOTS_PER_BAR = 8
+UNITS_PER_BAR = UNITS_PER_SLOT * SLOTS_PER_BAR
+
+_OCTAVE_MARK = {1: LOW_DOT, 2: "", 3: HIGH_DOT}
+
+
+# -----------------------------------------------------------
+# 1) Grammar
+# -----------------------------------------------------------
+def token_units(tok):
+    """Slot units covered by one token (0 for tokens the grammar ignores)."""
+    if tok.startswith("<REST_") and tok[6:-1].isdigit():
+        return int(tok[6:-1])
+    if tok in thai_base:
+        return 1
+    return 0
+
+
+def slot_grammar(vocab, allowed_oct=None, max_leap=None, merge_rests=True):
+    """
+    vocab:       token list in model order (id i ↔ vocab[i])
+    allowed_oct: optional {note: [octaves]} (e.g. constants.allowed_oct);
+                 notes missing from it, or mapped to [], are never sampled.
+                 When given, every sampled pitch gets an octave: the allowed
+                 one closest to the previous pitch.
+    max_leap:    with allowed_oct, also mask pitches whose closest allowed
+                 octave is more than this many semitones away
+    merge_rests: mask a rest directly after a rest inside the same slot
+
+    Returns a grammar dict (static tables; masks are cached lazily).
+    """
+    units = np.array([token_units(t) for t in vocab], dtype=np.int64)
+    is_rest = np.array([t.startswith("<REST_") for t in vocab])
+    is_pitch = np.array([t in thai_base for t in vocab])
+
+    return {
+        "vocab": list(vocab),
+        "units": units,
+        "is_rest": is_rest,
+        "is_pitch": is_pitch,
+        "allowed_oct": allowed_oct,
+        "max_leap": max_leap,
+        "merge_rests": merge_rests,
+        "_cache": {},
+    }
+
+
+def _octave_choice(grammar, note, prev_pitch):
+    """(octave, midi_pitch) closest to prev_pitch, or None if masked."""
+    octaves = grammar["allowed_oct"].get(note, [])
+    if not octaves:
+        return None
+
+    candidates = [(o, thai_base[note] + octave_offset[o]) for o in octaves]
+    if prev_pitch is None:
+        # no reference yet: middle octave if allowed, else the lowest one
+        return next((c for c in candidates if c[0] == 2), candidates[0])
+
+    octave, pitch = min(candidates, key=lambda c: (abs(c[1] - prev_pitch), c[0] != 2))
+    if grammar["max_leap"] is not None and abs(pitch - prev_pitch) > grammar["max_leap"]:
+        return None
+    return octave, pitch
+
+
+def _mask(grammar, state):
+    """Boolean mask over the vocab for the current state (cached)."""
+    remaining = UNITS_PER_SLOT - state["slot_pos"]
+    after_rest = grammar["merge_rests"] and state["slot_pos"] > 0 and state["prev_rest"]
+    prev_pitch = state["prev_pitch"] if grammar["allowed_oct"] is not None else None
+
+    key = (remaining, after_rest, prev_pitch)
+    cached = grammar["_cache"].get(key)
+    if cached is not None:
+        return cached
+
+    mask = (grammar["units"] > 0) & (grammar["units"] <= remaining)
+    if after_rest:
+        mask &= ~grammar["is_rest"]
+
+    octaves = {}
+    if grammar["allowed_oct"] is not None:
+        for i in np.flatnonzero(mask & grammar["is_pitch"]):
+            choice = _octave_choice(grammar, grammar["vocab"][i], prev_pitch)
+            if choice is None:
+                mask[i] = False
+            else:
+                octaves[i] = choice
+
+    grammar["_cache"][key] = (mask, octaves)
+    return mask, octaves
+
+
+# -----------------------------------------------------------
+# 2) Sampling state
+# -----------------------------------------------------------
+def new_state(fragment_slots=()):
+    """
+    Sampling state positioned right after a seed fragment
+    (list of slot strings; its octave marks seed prev_pitch).
+    """
+    state = {
+        "slot_pos": 0,
+        "units": 0,
+        "prev_rest": False,
+        "prev_pitch": None,
+        "steps": 0,
+        "masked_steps": 0,
+        "masked_tokens": 0,
+        "masked_mass": 0.0,
+        "fallback_steps": 0,
+    }
+
+    for slot in fragment_slots:
+        for tok in normalize_token(slot):
+            _advance_units(state, tok)
+
+        # last explicit note of the fragment anchors octave tracking
+        for i, ch in enumerate(slot):
+            if ch in thai_base:
+                mark = slot[i + 1] if i + 1 < len(slot) else ""
+                octave = {LOW_DOT: 1, HIGH_DOT: 3}.get(mark, 2)
+                state["prev_pitch"] = thai_base[ch] + octave_offset[octave]
+
+    return state
+
+
+def _advance_units(state, tok):
+    n = token_units(tok)
+    state["units"] += n
+    state["slot_pos"] = (state["slot_pos"] + n) % UNITS_PER_SLOT
+    state["prev_rest"] = tok.startswith("<REST_")
+
+
+def constrain(grammar, state, probs):
+    """
+    Zero out grammar-violating tokens in `probs` and renormalize.
+    Updates the masking counters in `state`. Returns (probs, octaves):
+    octaves maps allowed pitch ids → (octave, midi_pitch).
+
+    If nothing with non-zero probability survives (e.g. the model puts
+    all mass on rests inside a half-filled slot), the valid tokens are
+    sampled uniformly and the step is counted in fallback_steps.
+    """
+    mask, octaves = _mask(grammar, state)
+    probs = np.asarray(probs, dtype=np.float64)
+
+    removed = probs[~mask]
+    state["steps"] += 1
+    n_masked = int(np.count_nonzero(removed))
+    if n_masked:
+        state["masked_steps"] += 1
+        state["masked_tokens"] += n_masked
+        if probs.sum() > 0:
+            state["masked_mass"] += float(removed.sum() / probs.sum())
+
+    out = np.where(mask, probs, 0.0)
+    total = out.sum()
+    if total <= 0:
+        state["fallback_steps"] += 1
+        out = mask.astype(np.float64)
+        total = out.sum()
+        if total == 0:
+            raise ValueError("grammar masks every token (check vocab / allowed_oct)")
+    return out / total, octaves
+
+
+def advance(grammar, state, token_id, octaves):
+    """Move the state past a sampled token; returns its octave (or None)."""
+    tok = grammar["vocab"][token_id]
+    _advance_units(state, tok)
+
+    choice = octaves.get(token_id)
+    if choice is None:
+        return None
+    state["prev_pitch"] = choice[1]
+    return choice[0]
+
+
+def mask_stats(state):
+    """Counters for reporting / batch rows."""
+    steps = max(state["steps"], 1)
+    return {
+        "steps": state["steps"],
+        "masked_steps": state["masked_steps"],
+        "masked_tokens": state["masked_tokens"],
+        "masked_mass_mean": state["masked_mass"] / steps,
+        "fallback_steps": state["fallback_steps"],
+    }
+
+
+# -----------------------------------------------------------
+# 3) Generic loop
+# -----------------------------------------------------------
+def sample_constrained(next_probs, seed_ids, grammar, fragment_slots=(),
+                       max_new_tokens=240, finish_bar=True, seed=None):
+    """
+    next_probs:     callable(list_of_ids) → probability vector over vocab
+    seed_ids:       context ids the model starts from
+    fragment_slots: seed fragment as slot strings (sets slot/bar position)
+    finish_bar:     keep sampling past max_new_tokens until the bar is full
+
+    Returns (new_ids, octaves, state): octaves[i] is the octave of
+    new_ids[i] (None for rests or when octaves are not tracked).
+    """
+    rng = np.random.default_rng(seed)
+    state = new_state(fragment_slots)
+
+    ids = list(seed_ids)
+    new_ids, new_octaves = [], []
+
+    while len(new_ids) < max_new_tokens or (finish_bar and state["units"] % UNITS_PER_BAR):
+        probs, octaves = constrain(grammar, state, next_probs(ids))
+        idx = int(rng.choice(len(probs), p=probs))
+
+        new_octaves.append(advance(grammar, state, idx, octaves))
+        new_ids.append(idx)
+        ids.append(idx)
+
+    return new_ids, new_octaves, state
+
+
+def _slot_units(slot):
+    """
+    One string per unit of a slot (a dash, or a note with its octave
+    mark), counted as normalize_token counts them.
+    """
+    units = []
+    for ch in slot.strip():
+        if ch == "-" or ch in thai_base:
+            units.append(ch)
+        elif ch in (LOW_DOT, HIGH_DOT) and units and units[-1] != "-":
+            units[-1] += ch
+    return units or ["-"]
+
+
+def tokens_to_slots(tokens, octaves=None, fragment_slots=()):
+    """
+    Grammar-conforming tokens → slot strings (octave marks added when
+    octaves are given). Same layout as combine_fragment_and_generated.
+
+    fragment_slots: seed fragment to prepend. The sampler counts slot
+    positions over fragment + tokens, so from the first fragment slot
+    that is not 4 units long on, fragment and tokens are re-chunked
+    together; earlier fragment slots are kept as written.
+    """
+    head = list(fragment_slots)
+    parts = []
+    for i, slot in enumerate(fragment_slots):
+        if len(_slot_units(slot)) != UNITS_PER_SLOT:
+            head = list(fragment_slots[:i])
+            parts = [u for rest in fragment_slots[i:] for u in _slot_units(rest)]
+            break
+
+    for i, tok in enumerate(tokens):
+        if tok.startswith("<REST_"):
+            parts.append("-" * int(tok[6:-1]))
+        else:
+            octave = octaves[i] if octaves is not None else None
+            parts.append(tok + _OCTAVE_MARK.get(octave, ""))
+
+    slots, current, filled = [], "", 0
+    for part in parts:
+        current += part
+        filled += part.count("-") + sum(ch in thai_base for ch in part)
+        if filled >= UNITS_PER_SLOT:
+            slots.append(current)
+            current, filled = "", 0
+    if current:
+        slots.append(current)
+    return head + slots
+
+
+# -----------------------------------------------------------
+# 4) Generator adapters
+# -----------------------------------------------------------
+def ngram_next_probs(lm, vocab, n=3, alpha=0.01):
+    """next_probs for an n-gram LM from build_ngram_lm (Laplace smoothing)."""
+    ctx_len = n - 1
+
+    def next_probs(ids):
+        context = tuple(vocab[i] for i in ids[-ctx_len:]) if ctx_len > 0 else ()
+        counts = lm.get(context, {})
+        return np.array([counts.get(tok, 0) + alpha for tok in vocab], dtype=np.float64)
+
+    return next_probs
+
+
+def lstm_next_probs(model, seq_len=16, temperature=1.0, device=None):
+    """next_probs for the Stage 3 LSTMLanguageModel (softmax(logits / T))."""
+    import torch
+
+    model.eval()
+    if device is None:
+        device = next(model.parameters()).device
+
+    def next_probs(ids):
+        x = torch.tensor(ids[-seq_len:], dtype=torch.long, device=device).unsqueeze(0)
+        with torch.no_grad():
+            logits = model(x)[0] / temperature
+        return torch.softmax(logits, dim=-1).double().cpu().numpy()
+
+    return next_probs
+
+
+def _fragment_tokens(fragment_slots):
+    tokens = []
+    for slot in fragment_slots:
+        tokens.extend(normalize_token(slot))
+    return tokens
+
+
+def generate_constrained_ngram(
+    fragment_tokens,
+    lm,
+    vocab,
+    n=3,
+    max_new_tokens=240,
+    alpha=0.01,
+    allowed_oct=None,
+    max_leap=None,
+    finish_bar=True,
+    seed=None,
+):
+    """
+    Constrained counterpart of generate_from_fragment_ngram.
+
+    Returns {"tokens", "slots", "stats"}:
+        tokens  seed (n-1 tokens) + new tokens, as before
+                (postprocess_generated(..., seq_len=n-1) still works)
+        slots   fragment + generated slots (see tokens_to_slots), with
+                octave marks when allowed_oct is given (no octave
+                inference needed)
+        stats   mask_stats() counters
+    """
+    ctx_len = n - 1
+    normalized = _fragment_tokens(fragment_tokens)
+    if len(normalized) < ctx_len:
+        normalized = ["<REST_1>"] * (ctx_len - len(normalized)) + normalized
+    seed_toks = normalized[len(normalized) - ctx_len:]
+
+    token_to_id = {tok: i for i, tok in enumerate(vocab)}
+    seed_ids = [token_to_id[t] for t in seed_toks if t in token_to_id]
+
+    grammar = slot_grammar(vocab, allowed_oct=allowed_oct, max_leap=max_leap)
+    new_ids, octaves, state = sample_constrained(
+        ngram_next_probs(lm, vocab, n, alpha), seed_ids, grammar,
+        fragment_slots=fragment_tokens, max_new_tokens=max_new_tokens,
+        finish_bar=finish_bar, seed=seed,
+    )
+
+    new_tokens = [vocab[i] for i in new_ids]
+    return {
+        "tokens": seed_toks + new_tokens,
+        "slots": tokens_to_slots(new_tokens, octaves if allowed_oct else None, fragment_tokens),
+        "stats": mask_stats(state),
+    }
+
+
+def generate_constrained_lstm(
+    fragment_tokens,
+    model,
+    token_to_id,
+    id_to_token,
+    seq_len=16,
+    max_new_tokens=240,
+    temperature=0.8,
+    allowed_oct=None,
+    max_leap=None,
+    finish_bar=True,
+    seed=None,
+    pad_token="<REST_1>",
+):
+    """
+    Constrained counterpart of the LSTM generate_from_fragment.
+    Same return dict as generate_constrained_ngram
+    (tokens = seed window of seq_len + new tokens).
+    """
+    fragment_ids = [token_to_id[t] for t in _fragment_tokens(fragment_tokens) if t in token_to_id]
+    if len(fragment_ids) < seq_len:
+        fragment_ids = [token_to_id[pad_token]] * (seq_len - len(fragment_ids)) + fragment_ids
+    seed_ids = fragment_ids[-seq_len:]
+
+    vocab = [id_to_token[i] for i in range(len(id_to_token))]
+    grammar = slot_grammar(vocab, allowed_oct=allowed_oct, max_leap=max_leap)
+    new_ids, octaves, state = sample_constrained(
+        lstm_next_probs(model, seq_len, temperature), seed_ids, grammar,
+        fragment_slots=fragment_tokens, max_new_tokens=max_new_tokens,
+        finish_bar=finish_bar, seed=seed,
+    )
+
+    new_tokens = [vocab[i] for i in new_ids]
+    return {
+        "tokens": [vocab[i] for i in seed_ids] + new_tokens,
+        "slots": tokens_to_slots(new_tokens, octaves if allowed_oct else None, fragment_tokens),
+        "stats": mask_stats(state),
+    }
@@ -0,0 +1,208 @@
+# corpus.py
+# -----------------------------------------------------------
+# Song corpus loading + pitch/rest tokenization
+# Shared by:
+# - N-gram / LSTM generation notebooks
+# - Similarity, search and evaluation modules
+#
+# Token vocabulary (same as the Stage 3 notebooks):
+#   ด ร ม ฟ ซ ล ท                 pitch (octave marks dropped)
+#   <REST_1> … <REST_4>           compressed dash runs
+# -----------------------------------------------------------
+
+import json
+from collections import defaultdict
+from pathlib import Path
+
+from .preprocessing import flatten_song_data
+
+THAI_NOTES = "ดรมฟซลท"
+UP_MARK = "ํ"
+LOW_MARK = "ฺ"
+
+REST_TOKENS = ["<REST_1>", "<REST_2>", "<REST_3>", "<REST_4>"]
+
+
+# -----------------------------------------------------------
+# 1) Load every song JSON under songs/<motif>/<song>/json/
+# -----------------------------------------------------------
+def load_songs(data_root, motif=None):
+    """
+    Returns a list of song dicts:
+        {"motif", "song", "path", "data", "pitch_sequence"}
+
+    data_root: thai_music_data/ folder (or songs/ folder itself)
+    motif:     optional motif folder name to keep (e.g. "เขมร")
+    """
+    base = Path(data_root)
+    if (base / "songs").is_dir():
+        base = base / "songs"
+
+    songs = []
+
+    for motif_dir in sorted(base.iterdir()):
+        if not motif_dir.is_dir():
+            continue
+        if motif is not None and motif_dir.name != motif:
+            continue
+
+        for song_dir in sorted(motif_dir.iterdir()):
+            json_dir = song_dir / "json"
+            if not json_dir.exists():
+                continue
+
+            for json_file in sorted(json_dir.glob("*.json")):
+                try:
+                    with open(json_file, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception as e:
+                    print(f"⚠️ Skipped {json_file}: {e}")
+                    continue
+
+                songs.append({
+                    "motif": motif_dir.name,
+                    "song": song_dir.name,
+                    "path": str(json_file),
+                    "data": data,
+                    "pitch_sequence": song_to_pitch_sequence(data),
+                })
+
+    return songs
+
+
+def songs_by_motif(songs):
+    """Group song dicts into {motif: [song, ...]}."""
+    groups = defaultdict(list)
+    for s in songs:
+        groups[s["motif"]].append(s)
+    return dict(groups)
+
+
+# -----------------------------------------------------------
+# 2) Slot → pitch/rest tokens
+# -----------------------------------------------------------
+def _rest_tokens(dash_count):
+    rests = []
+    while dash_count > 0:
+        k = min(dash_count, 4)
+        rests.append(f"<REST_{k}>")
+        dash_count -= k
+    return rests
+
+
+def normalize_token(token):
+    """
+    Convert one slot string into pitch tokens + compressed rest tokens.
+
+    Rest compression rule:
+    - Any number of consecutive dashes is decomposed into
+      chunks of <REST_4>, <REST_3>, <REST_2>, <REST_1>
+    """
+    if not isinstance(token, str):
+        return ["<REST_1>"]
+
+    token = token.strip()
+
+    out = []
+    i = 0
+
+    while i < len(token):
+        ch = token[i]
+
+        if ch == "-":
+            dash_count = 0
+            while i < len(token) and token[i] == "-":
+                dash_count += 1
+                i += 1
+            out.extend(_rest_tokens(dash_count))
+
+        elif ch in THAI_NOTES:
+            out.append(ch)
+            i += 1
+
+            # skip octave mark
+            if i < len(token) and token[i] in {UP_MARK, LOW_MARK}:
+                i += 1
+
+        else:
+            i += 1
+
+    return out if out else ["<REST_1>"]
+
+
+def slots_to_tokens(slots):
+    """Normalize a flat slot list into one token list."""
+    tokens = []
+    for slot in slots:
+        tokens.extend(normalize_token(slot))
+    return tokens
+
+
+def tokens_to_dashes(tokens):
+    """Inverse of normalize_token: <REST_k> → k dashes, pitches kept."""
+    parts = []
+    for tok in tokens:
+        if tok.startswith("<REST_"):
+            parts.append("-" * int(tok[6:-1]))
+        else:
+            parts.append(tok)
+    return "".join(parts)
+
+
+# -----------------------------------------------------------
+# 3) Song JSON → token sequences
+# -----------------------------------------------------------
+def _bar_tokens(bar, sequence):
+    def process_token(tok):
+        if isinstance(tok, str):
+            sequence.extend(normalize_token(tok))
+        elif isinstance(tok, dict):
+            for key in tok:
+                for inner in tok[key]:
+                    process_token(inner)
+        elif isinstance(tok, list):
+            for inner in tok:
+                process_token(inner)
+
+    for tok in bar:
+        process_token(tok)
+
+
+def song_to_pitch_sequence(song_json):
+    """
+    Convert full song JSON → one flat pitch/rest token sequence.
+    Handles plain tokens, dict blocks (นำ/ตาม), nested lists.
+    """
+    sequence = []
+    for section in song_json.get("sections", []):
+        for bar in section.get("bars", []):
+            _bar_tokens(bar, sequence)
+    return sequence
+
+
+def section_sequences(song_json):
+    """
+    Returns [(section_name, token_list), ...] for every section,
+    after flattening nested section groups.
+    """
+    out = []
+    for section in flatten_song_data(song_json)["sections"]:
+        sequence = []
+        for bar in section.get("bars", []):
+            _bar_tokens(bar, sequence)
+        out.append((section.get("name", ""), sequence))
+    return out
+
+
+# -----------------------------------------------------------
+# 4) Vocabulary
+# -----------------------------------------------------------
+def build_vocab(songs):
+    """
+    Returns (vocab, token_to_id, id_to_token) over every
+    pitch_sequence, sorted like the Stage 3 notebooks.
+    """
+    vocab = sorted({tok for s in songs for tok in s["pitch_sequence"]})
+    token_to_id = {tok: i for i, tok in enumerate(vocab)}
+    id_to_token = {i: tok for tok, i in token_to_id.items()}
+    return vocab, token_to_id, id_to_token
@@ -0,0 +1,149 @@
+# eval_metrics.py
+# -----------------------------------------------------------
+# Generation metrics of the Stage 3 batch evaluation
+# (same definitions as run_single_eval / run_single_eval_ngram):
+# - rest_chi2        REST_1..4 distribution distance   ↓
+# - single_overlap   n-gram overlap with one song      ↑
+# - pitch_kl         KL(P_ref ‖ Q_gen), 7 pitches      ↓
+# - corpus_overlap   n-gram overlap with the corpus    ↑
+# - repetition_score duplicate n-gram fraction         ↓
+# - seg_decay_mean   per-bar corpus overlap, averaged  ↑
+# Plus the seed / combine helpers those runs rely on.
+# -----------------------------------------------------------
+
+from collections import Counter
+
+import numpy as np
+
+from .corpus import REST_TOKENS, slots_to_tokens, tokens_to_dashes
+
+THAI_PITCHES = ["ด", "ร", "ม", "ฟ", "ซ", "ล", "ท"]
+PITCH_IDX = {p: i for i, p in enumerate(THAI_PITCHES)}
+SLOTS_PER_BAR = 8
+
+METRIC_COLS = [
+    "rest_chi2",
+    "single_overlap",
+    "pitch_kl",
+    "corpus_overlap",
+    "repetition_score",
+    "seg_decay_mean",
+]
+
+# direction of each metric (the ↑ / ↓ above); the rest are lower-better
+HIGHER_BETTER = {"single_overlap", "corpus_overlap", "seg_decay_mean"}
+
+
+# -----------------------------------------------------------
+# 1) Seeds + combining
+# -----------------------------------------------------------
+def section_seed(song, section_idx=0):
+    """
+    First bar of song["data"]["sections"][section_idx] as a flat slot list
+    (extract_section_seed without the warnings; [] when unavailable).
+    """
+    sections = song["data"].get("sections", [])
+    if section_idx >= len(sections):
+        return []
+
+    bars = sections[section_idx].get("bars", [])
+    if not bars:
+        return []
+
+    first_bar = bars[0]
+    if isinstance(first_bar, list):
+        return [slot for slot in first_bar if isinstance(slot, str)]
+    if isinstance(first_bar, dict):
+        for val in first_bar.values():
+            if isinstance(val, list):
+                return [slot for slot in val if isinstance(slot, str)]
+    return []
+
+
+def combine_slots(fragment_slots, generated_tokens, seq_len):
+    """
+    combine_fragment_and_generated: fragment kept as is, generated tokens
+    (minus the seq_len seed window) re-chopped into 4-char slots.
+    Octave inference is skipped — none of the metrics see octave marks.
+    """
+    generated = tokens_to_dashes(generated_tokens[seq_len:])
+    return list(fragment_slots) + [generated[i:i + 4] for i in range(0, len(generated), 4)]
+
+
+# -----------------------------------------------------------
+# 2) Metrics
+# -----------------------------------------------------------
+def ngrams(tokens, n):
+    return [tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+
+def rest_distribution(tokens):
+    """Fractions of REST_1..4 among rest tokens (zeros if there are none)."""
+    counts = Counter(t for t in tokens if t.startswith("<REST"))
+    total = sum(counts.values()) or 1
+    return np.array([counts.get(r, 0) / total for r in REST_TOKENS])
+
+
+def pitch_distribution(tokens, eps=1e-8):
+    """7-note pitch distribution + eps, as in _kl_scalar."""
+    counts = Counter(t for t in tokens if t in PITCH_IDX)
+    total = sum(counts.values()) or 1
+    return np.array([counts.get(p, 0) / total for p in THAI_PITCHES]) + eps
+
+
+def rest_chi2(ref_tokens, gen_tokens):
+    return float(((rest_distribution(ref_tokens) - rest_distribution(gen_tokens)) ** 2).sum())
+
+
+def pitch_kl(ref_tokens, gen_tokens):
+    p, q = pitch_distribution(ref_tokens), pitch_distribution(gen_tokens)
+    return float(np.sum(p * np.log(p / q)))
+
+
+def overlap(gen_ngrams, reference):
+    """Fraction of gen_ngrams found in the reference n-gram set."""
+    if not gen_ngrams:
+        return 0.0
+    return sum(1 for g in gen_ngrams if g in reference) / len(gen_ngrams)
+
+
+def repetition_score(tokens, n=3):
+    """(total − unique) / total over the n-grams of tokens."""
+    grams = ngrams(tokens, n)
+    if not grams:
+        return 0.0
+    return sum(c - 1 for c in Counter(grams).values()) / len(grams)
+
+
+def seg_decay_mean(combined_slots, corpus_ngrams, n=3):
+    """Mean corpus overlap of consecutive one-bar windows."""
+    scores = []
+    for start in range(0, len(combined_slots) - SLOTS_PER_BAR + 1, SLOTS_PER_BAR):
+        win = ngrams(slots_to_tokens(combined_slots[start:start + SLOTS_PER_BAR]), n)
+        if win:
+            scores.append(overlap(win, corpus_ngrams))
+    return float(np.mean(scores)) if scores else float("nan")
+
+
+def generation_metrics(combined_slots, ref_tokens, corpus_ngrams, metric_n=3):
+    """
+    The six batch-eval metrics for one generated piece.
+
+    combined_slots: fragment + generated slots (combine_slots output)
+    ref_tokens:     reference song pitch_sequence
+    corpus_ngrams:  set of metric_n-gram tuples of the training corpus
+
+    Returns {metric: value} rounded to 6 places like the CSV rows.
+    """
+    gen = slots_to_tokens(combined_slots)
+    gen_ngrams = ngrams(gen, metric_n)
+
+    row = {
+        "rest_chi2": rest_chi2(ref_tokens, gen),
+        "single_overlap": overlap(gen_ngrams, set(ngrams(ref_tokens, metric_n))),
+        "pitch_kl": pitch_kl(ref_tokens, gen) if ref_tokens else float("nan"),
+        "corpus_overlap": overlap(gen_ngrams, corpus_ngrams),
+        "repetition_score": repetition_score(gen, metric_n),
+        "seg_decay_mean": seg_decay_mean(combined_slots, corpus_ngrams, metric_n),
+    }
+    return {k: round(v, 6) for k, v in row.items()}
@@ -0,0 +1,169 @@
+# loso_eval.py
+# -----------------------------------------------------------
+# Leave-one-song-out evaluation of the n-gram baseline
+#
+# Full-motif counts are built once; for each song its own counts are
+# subtracted (ngram_model.held_out), so the model never sees the song it is
+# scored on. Per held-out song and every (n, alpha, smoothing):
+# - held-out perplexity (and the in-sample perplexity for comparison)
+# - the six batch-eval metrics, generated from every section seed, with
+#   the held-out song as reference and the remaining songs as corpus
+#
+# Usage:
+#   python3 -m thai_music_utils.loso_eval --motif เขมร
+#   python3 -m thai_music_utils.loso_eval --motif ลาว --methods laplace witten_bell --no-generate
+# -----------------------------------------------------------
+
+import argparse
+from pathlib import Path
+
+from .corpus import load_songs
+from .eval_metrics import combine_slots, generation_metrics, section_seed
+from .ngram_model import (
+    SMOOTHING_METHODS,
+    build_ngram_counts,
+    generate,
+    held_out,
+    ngram_set,
+    perplexity,
+)
+
+DEFAULT_NS = (2, 3, 4)
+DEFAULT_ALPHAS = (0.001, 0.01, 0.1, 1.0)
+DEFAULT_SEEDS = (42, 43, 44, 45, 46)
+
+
+def run_loso_eval(
+    songs,
+    motif,
+    ns=DEFAULT_NS,
+    alphas=DEFAULT_ALPHAS,
+    methods=("laplace",),
+    seeds=DEFAULT_SEEDS,
+    max_new_tokens=240,
+    metric_n=3,
+    generate_runs=True,
+    progress=True,
+):
+    """
+    songs: load_songs() output (vocab is taken from all of them, as in the
+           notebooks); only songs of `motif` are trained on / held out.
+
+    Returns (ppl_df, gen_df):
+        ppl_df  song, n, alpha, method, tokens, ppl_heldout, ppl_in
+        gen_df  song, section_idx, section_name, n, alpha, method, seed,
+                + METRIC_COLS (empty when generate_runs=False)
+    """
+    import pandas as pd
+
+    model = build_ngram_counts(songs, n_max=max(max(ns), metric_n), motif=motif)
+    motif_songs = [s for s in songs if s["motif"] == motif]
+
+    iterator = motif_songs
+    if progress:
+        from tqdm.auto import tqdm
+        iterator = tqdm(motif_songs, desc=f"LOSO ({motif})")
+
+    ppl_rows, gen_rows = [], []
+    grid = [(n, alpha, method) for n in ns for alpha in alphas for method in methods]
+
+    for song in iterator:
+        seq = song["pitch_sequence"]
+        in_sample = {key: perplexity(model, seq, *key) for key in grid}
+
+        with held_out(model, seq):
+            for key in grid:
+                n, alpha, method = key
+                ppl_rows.append({
+                    "song": song["song"],
+                    "n": n,
+                    "alpha": alpha,
+                    "method": method,
+                    "tokens": len(seq),
+                    "ppl_heldout": perplexity(model, seq, n, alpha, method),
+                    "ppl_in": in_sample[key],
+                })
+
+            if not generate_runs:
+                continue
+
+            corpus_ngrams = ngram_set(model, metric_n)
+            sections = song["data"].get("sections", [])
+            seeds_by_section = [(i, section_seed(song, i)) for i in range(len(sections))]
+
+            for n, alpha, method in grid:
+                cache = {}
+                for sec_idx, fragment in seeds_by_section:
+                    if not fragment:
+                        continue
+                    for seed in seeds:
+                        tokens = generate(model, fragment, n, max_new_tokens, alpha,
+                                          method, seed=seed, cache=cache)
+                        row = {
+                            "song": song["song"],
+                            "section_idx": sec_idx,
+                            "section_name": sections[sec_idx].get("name", str(sec_idx)),
+                            "n": n,
+                            "alpha": alpha,
+                            "method": method,
+                            "seed": seed,
+                        }
+                        row.update(generation_metrics(
+                            combine_slots(fragment, tokens, n - 1), seq, corpus_ngrams, metric_n
+                        ))
+                        gen_rows.append(row)
+
+    return pd.DataFrame(ppl_rows), pd.DataFrame(gen_rows)
+
+
+def summarize(ppl_df, gen_df=None):
+    """Mean over songs per (n, alpha, method): perplexities + metric means."""
+    keys = ["n", "alpha", "method"]
+    summary = ppl_df.groupby(keys)[["ppl_heldout", "ppl_in"]].mean()
+    if gen_df is not None and len(gen_df):
+        from .eval_metrics import METRIC_COLS
+        summary = summary.join(gen_df.groupby(keys)[METRIC_COLS].mean())
+    return summary.reset_index()
+
+
+# -----------------------------------------------------------
+# CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Leave-one-song-out n-gram evaluation.")
+    parser.add_argument("--motif", required=True, help="Motif folder name, e.g. เขมร")
+    parser.add_argument("--ns", type=int, nargs="+", default=list(DEFAULT_NS))
+    parser.add_argument("--alphas", type=float, nargs="+", default=list(DEFAULT_ALPHAS))
+    parser.add_argument("--methods", nargs="+", default=["laplace"], choices=SMOOTHING_METHODS)
+    parser.add_argument("--seeds", type=int, nargs="+", default=list(DEFAULT_SEEDS))
+    parser.add_argument("--max-new-tokens", type=int, default=240)
+    parser.add_argument("--metric-n", type=int, default=3)
+    parser.add_argument("--no-generate", action="store_true", help="Perplexity only")
+    parser.add_argument("--out-dir", default=None, help="Default: outputs/eval/ngram/")
+    args = parser.parse_args()
+
+    root = Path(__file__).parent.parent
+    out_dir = Path(args.out_dir) if args.out_dir else root / "outputs" / "eval" / "ngram"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    songs = load_songs(root / "thai_music_data")
+    ppl_df, gen_df = run_loso_eval(
+        songs, args.motif, ns=args.ns, alphas=args.alphas, methods=args.methods,
+        seeds=args.seeds, max_new_tokens=args.max_new_tokens,
+        metric_n=args.metric_n, generate_runs=not args.no_generate,
+    )
+
+    ppl_path = out_dir / f"loso_ppl_{args.motif}.csv"
+    ppl_df.to_csv(ppl_path, index=False, encoding="utf-8-sig")
+    print(f"💾 {len(ppl_df)} perplexity rows → {ppl_path}")
+
+    if len(gen_df):
+        gen_path = out_dir / f"loso_eval_results_{args.motif}.csv"
+        gen_df.to_csv(gen_path, index=False, encoding="utf-8-sig")
+        print(f"💾 {len(gen_df)} generation rows → {gen_path}")
+
+    print(summarize(ppl_df, gen_df).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
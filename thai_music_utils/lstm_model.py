@@ -0,0 +1,60 @@
+# lstm_model.py
+# -----------------------------------------------------------
+# The Stage 3 LSTM language model, outside the notebooks
+# - LSTMLanguageModel: same layers and parameter names as the
+#   notebook class, so the saved state_dicts load unchanged
+# - generate_sequence: temperature sampling from seed ids
+# Requires torch (imported at module level — import this module
+# lazily from code that should work without it).
+# -----------------------------------------------------------
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class LSTMLanguageModel(nn.Module):
+    """Embedding → stacked LSTM → linear head on the last timestep."""
+
+    def __init__(self, vocab_size, embed_dim=64, hidden_dim=128, num_layers=2, dropout=0.25):
+        super().__init__()
+        self.embedding = nn.Embedding(num_embeddings=vocab_size, embedding_dim=embed_dim)
+        self.lstm = nn.LSTM(
+            input_size=embed_dim,
+            hidden_size=hidden_dim,
+            num_layers=num_layers,
+            dropout=dropout,
+            batch_first=True,
+        )
+        self.fc = nn.Linear(hidden_dim, vocab_size)
+
+    def forward(self, x):
+        """x: (batch, seq_len) token ids → (batch, vocab_size) logits."""
+        output, _ = self.lstm(self.embedding(x))
+        return self.fc(output[:, -1, :])
+
+
+def generate_sequence(model, seed_ids, max_new_tokens=100, temperature=1.0,
+                      seed=None, context_len=16):
+    """
+    generate_sequence of the notebooks. Those always fed the last 16 ids,
+    whatever SEQ_LEN the model was trained with; keep context_len=16 to
+    reproduce their batch runs.
+    """
+    model.eval()
+    device = next(model.parameters()).device
+
+    if seed is not None:
+        torch.manual_seed(seed)
+        if torch.cuda.is_available():
+            torch.cuda.manual_seed_all(seed)
+
+    generated = list(seed_ids)
+    for _ in range(max_new_tokens):
+        x = torch.tensor(generated[-context_len:], dtype=torch.long, device=device).unsqueeze(0)
+        with torch.no_grad():
+            logits = model(x)
+        probs = F.softmax(logits / temperature, dim=-1)
+        generated.append(torch.multinomial(probs, num_samples=1).item())
+
+    return generated
@@ -0,0 +1,379 @@
+# markov_metrics.py
+# -----------------------------------------------------------
+# Expected generation metrics of the n-gram baseline, computed from its
+# Markov chain instead of by sampling seeds
+#
+# An order-n model is a Markov chain over the last L tokens
+# (L = max(n − 1, metric_n − 1)). From a seed fragment's final state the
+# k-step state distributions are propagated for max_new_tokens steps with a
+# sparse transition matrix. Summing them gives the expected count of every
+# token and every metric_n-gram in the generated continuation, and from
+# those counts the expected:
+# - pitch / rest distributions → pitch_kl, rest_chi2 against any reference song
+# - repetition_score (Poisson approximation for n-gram types)
+# The stationary distribution gives the long-run limit of the same quantities.
+#
+# Caveat: the batch metrics re-tokenize the generated dash string slot by slot,
+# so adjacent generated rests can merge. The chain sees raw tokens, so its
+# rest-based estimates are the least exact.
+#
+# Usage (estimate the grid and compare with a batch CSV):
+#   python3 -m thai_music_utils.markov_metrics --motif เขมร --ref-song เขมรพวง \
+#       --csv outputs/eval/ngram/batch_eval_results_khmer_ngram.csv
+# -----------------------------------------------------------
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+from .corpus import REST_TOKENS, slots_to_tokens
+from .eval_metrics import THAI_PITCHES, METRIC_COLS, ngrams, section_seed
+from .ngram_model import build_ngram_counts, next_token_probs
+
+ESTIMATED_METRICS = ("pitch_kl", "rest_chi2", "repetition_score")
+
+
+# -----------------------------------------------------------
+# 1) Chain
+# -----------------------------------------------------------
+def markov_chain(model, n=3, alpha=0.01, method="laplace", metric_n=3, **kwargs):
+    """
+    Returns a chain dict:
+        P      (V^L × V) next-token probabilities per state
+        T      CSR (V^L × V^L) state transition matrix
+        L, n, metric_n, V
+    """
+    V = model["V"]
+    L = max(n - 1, metric_n - 1, 1)
+    n_states = V ** L
+
+    ctx_len = n - 1
+    contexts = np.zeros((1, 0), dtype=np.int64)
+    if ctx_len:
+        contexts = np.array(np.unravel_index(np.arange(V ** ctx_len), (V,) * ctx_len)).T
+    P_ctx = next_token_probs(model, contexts, n, alpha, method, **kwargs)
+    P_ctx /= P_ctx.sum(axis=1, keepdims=True)
+
+    states = np.arange(n_states)
+    P = P_ctx[states % (V ** ctx_len)]
+
+    rows = np.repeat(states, V)
+    cols = ((states % (V ** (L - 1))) * V)[:, None] + np.arange(V)[None, :]
+    T = sparse.csr_matrix((P.ravel(), (rows, cols.ravel())), shape=(n_states, n_states))
+
+    return {"P": P, "T": T, "L": L, "n": n, "metric_n": metric_n, "V": V}
+
+
+def start_state(model, chain, tokens):
+    """State id of the last L tokens (left-padded with <REST_1>)."""
+    L, V = chain["L"], chain["V"]
+    tail = list(tokens[-L:]) if L else []
+    tail = ["<REST_1>"] * (L - len(tail)) + tail
+    state = 0
+    for tok in tail:
+        state = state * V + model["token_to_id"][tok]
+    return state
+
+
+def stationary_distribution(chain, tol=1e-12, max_iter=100000):
+    """Long-run state distribution by power iteration (π ← π T)."""
+    TT = chain["T"].T.tocsr()
+    pi = np.full(TT.shape[0], 1.0 / TT.shape[0])
+    for _ in range(max_iter):
+        nxt = TT @ pi
+        if np.abs(nxt - pi).sum() < tol:
+            return nxt
+        pi = nxt
+    return pi
+
+
+def occupancy(chain, starts, steps):
+    """
+    Expected number of visits to each state over `steps` generation steps,
+    one row per start state: Σ_{t<steps} e_start T^t.
+    """
+    TT = chain["T"].T.tocsr()
+    pi = np.zeros((TT.shape[0], len(starts)))
+    pi[starts, np.arange(len(starts))] = 1.0
+
+    occ = np.zeros_like(pi)
+    for _ in range(steps):
+        occ += pi
+        pi = TT @ pi
+    return occ.T
+
+
+def count_covariance(chain, starts, steps):
+    """
+    Covariance (S × V × V) of the generated token counts, exact for the chain.
+
+    Forward: P(state s at step t). Backward: B_r(s', j), the expected number
+    of j emitted in the r steps after s'. Then
+        E[N_i N_j] = δ_ij E[N_i] + Σ_t Σ_s P(s, t) P(i|s) B_{steps-t-1}(s·i, j) + (i ↔ j)
+    Cost: O(steps × S × V^L × V²) — fine up to n = 4.
+    """
+    T, P, V, L = chain["T"], chain["P"], chain["V"], chain["L"]
+    n_states = P.shape[0]
+    nxt = ((np.arange(n_states) % (V ** (L - 1))) * V)[:, None] + np.arange(V)[None, :]
+
+    backward = np.zeros((steps, n_states, V))
+    for r in range(1, steps):
+        backward[r] = P + T @ backward[r - 1]
+
+    TT = T.T.tocsr()
+    pi = np.zeros((n_states, len(starts)))
+    pi[starts, np.arange(len(starts))] = 1.0
+
+    mean = np.zeros((len(starts), V))
+    cross = np.zeros((V, len(starts), V))
+    for t in range(steps):
+        emit = pi.T[:, :, None] * P[None]                   # S × states × V(i)
+        mean += emit.sum(axis=1)
+        later = backward[steps - t - 1][nxt]                # states × V(i) × V(j)
+        cross += emit.transpose(2, 0, 1) @ later.transpose(1, 0, 2)
+        pi = TT @ pi
+
+    cross = cross.transpose(1, 0, 2)                         # S × i × j
+    second = cross + cross.transpose(0, 2, 1)
+    idx = np.arange(V)
+    second[:, idx, idx] += mean
+    return second - mean[:, :, None] * mean[:, None, :]
+
+
+def _ratio_variance(cov, counts, idx):
+    """Delta-method variance of counts[idx] / counts[idx].sum()."""
+    total = counts[idx].sum()
+    if total <= 0:
+        return np.zeros(len(idx))
+    q = counts[idx] / total
+    J = (np.eye(len(idx)) - q[:, None]) / total
+    return np.einsum("ab,bc,ac->a", J, cov[np.ix_(idx, idx)], J)
+
+
+def expected_counts(chain, occ):
+    """
+    (token_counts, gram_counts) expected in the generated continuation:
+        token_counts  (S × V)
+        gram_counts   (S × V^metric_n), grams ending at generated tokens
+    """
+    V, L, m = chain["V"], chain["L"], chain["metric_n"]
+    P = chain["P"]
+    S = occ.shape[0]
+
+    tokens = occ @ P
+
+    # gram = (last m-1 tokens of the state, next token); sum out older tokens
+    prefix, suffix = V ** (L - m + 1), V ** (m - 1)
+    joint = occ.reshape(S, prefix, suffix, 1) * P.reshape(1, prefix, suffix, V)
+    grams = joint.sum(axis=1).reshape(S, suffix * V)
+    return tokens, grams
+
+
+# -----------------------------------------------------------
+# 2) Expected metrics
+# -----------------------------------------------------------
+def _dist(counts, idx):
+    sub = counts[..., idx]
+    total = sub.sum(axis=-1, keepdims=True)
+    return sub / np.where(total > 0, total, 1.0)
+
+
+def _token_counts(model, tokens):
+    return np.bincount([model["token_to_id"][t] for t in tokens], minlength=model["V"]).astype(float)
+
+
+def expected_metrics(model, chain, fragment_tokens, ref_token_lists, max_new_tokens=240,
+                     occ=None, cov=None):
+    """
+    Expected pitch_kl / rest_chi2 (per reference song) and repetition_score
+    for one seed fragment (normalized tokens).
+
+    cov: optional (V × V) count covariance from count_covariance(). Without
+         it the metrics are plug-in values at the expected distributions,
+         which underestimate E[KL] and E[χ²] (both are convex); with it
+         a second-order (delta-method) correction is added.
+
+    Returns {"pitch_kl": array(len(refs)), "rest_chi2": array(len(refs)),
+             "repetition_score": float, "pitch_dist", "rest_dist"}
+    """
+    vocab = model["vocab"]
+    pitch_idx = [vocab.index(p) for p in THAI_PITCHES if p in vocab]
+    rest_idx = [vocab.index(r) for r in REST_TOKENS if r in vocab]
+
+    if occ is None:
+        occ = occupancy(chain, [start_state(model, chain, fragment_tokens)], max_new_tokens)
+    gen_tokens, gen_grams = expected_counts(chain, occ)
+    counts = _token_counts(model, fragment_tokens) + gen_tokens[0]
+
+    q_pitch = _dist(counts, pitch_idx) + 1e-8
+    q_rest = _dist(counts, rest_idx)
+
+    refs = np.array([_token_counts(model, r) for r in ref_token_lists]).reshape(-1, model["V"])
+    p_pitch = _dist(refs, pitch_idx) + 1e-8
+    p_rest = _dist(refs, rest_idx)
+
+    # repetition: fragment grams are certain, generated ones ~ Poisson(λ)
+    m = chain["metric_n"]
+    frag_keys = np.zeros(model["V"] ** m, dtype=bool)
+    for g in ngrams(fragment_tokens, m):
+        key = 0
+        for tok in g:
+            key = key * model["V"] + model["token_to_id"][tok]
+        frag_keys[key] = True
+
+    total = max(len(fragment_tokens) - m + 1, 0) + max_new_tokens
+    unique = frag_keys.sum() + (1.0 - np.exp(-gen_grams[0][~frag_keys])).sum()
+
+    pitch_kl = (p_pitch * np.log(p_pitch / q_pitch)).sum(axis=1)
+    rest_chi2 = ((p_rest - q_rest) ** 2).sum(axis=1)
+    if cov is not None:
+        pitch_kl = pitch_kl + 0.5 * (p_pitch * _ratio_variance(cov, counts, pitch_idx) / q_pitch ** 2).sum(axis=1)
+        rest_chi2 = rest_chi2 + _ratio_variance(cov, counts, rest_idx).sum()
+
+    return {
+        "pitch_kl": pitch_kl,
+        "rest_chi2": rest_chi2,
+        "repetition_score": float((total - unique) / total) if total else 0.0,
+        "pitch_dist": q_pitch - 1e-8,
+        "rest_dist": q_rest,
+    }
+
+
+def estimate_grid(songs, motif, ns=(2, 3, 4), alphas=(0.001, 0.01, 0.1, 1.0),
+                  method="laplace", ref_songs=None, metric_n=3, max_new_tokens=240,
+                  batch_songs=None, second_order=True):
+    """
+    Expected metrics for every (seed song, section, n, alpha) × reference song.
+
+    ref_songs:    reference song names (default: every song of the motif)
+    batch_songs:  seed songs (default: every song of the motif)
+    second_order: add the count-covariance correction (see expected_metrics)
+
+    Returns a long DataFrame: song, section_idx, n, alpha, ref_song,
+    pitch_kl, rest_chi2, repetition_score.
+    """
+    import pandas as pd
+
+    motif_songs = [s for s in songs if s["motif"] == motif]
+    by_name = {s["song"]: s for s in motif_songs}
+    ref_songs = list(ref_songs or by_name)
+    refs = [by_name[r]["pitch_sequence"] for r in ref_songs]
+    seed_songs = [by_name[name] for name in (batch_songs or by_name)]
+
+    fragments = []
+    for s in seed_songs:
+        for i in range(len(s["data"].get("sections", []))):
+            frag = section_seed(s, i)
+            if frag:
+                fragments.append((s["song"], i, slots_to_tokens(frag)))
+
+    model = build_ngram_counts(songs, n_max=max(max(ns), metric_n), motif=motif)
+
+    rows = []
+    for n in ns:
+        for alpha in alphas:
+            chain = markov_chain(model, n, alpha, method, metric_n=metric_n)
+            starts = [start_state(model, chain, toks) for _, _, toks in fragments]
+            occ = occupancy(chain, starts, max_new_tokens)
+            covs = count_covariance(chain, starts, max_new_tokens) if second_order else [None] * len(starts)
+
+            for (song, sec_idx, toks), occ_row, cov in zip(fragments, occ, covs):
+                est = expected_metrics(model, chain, toks, refs, max_new_tokens, occ=occ_row[None], cov=cov)
+                for r, ref in enumerate(ref_songs):
+                    rows.append({
+                        "song": song, "section_idx": sec_idx, "n": n, "alpha": alpha,
+                        "ref_song": ref,
+                        "pitch_kl": float(est["pitch_kl"][r]),
+                        "rest_chi2": float(est["rest_chi2"][r]),
+                        "repetition_score": est["repetition_score"],
+                    })
+
+    return pd.DataFrame(rows)
+
+
+# -----------------------------------------------------------
+# 3) Comparison with sampled batch results
+# -----------------------------------------------------------
+def compare_with_batch(estimates, batch_df, ref_song):
+    """
+    Join expected metrics with the seed-averaged sampled metrics of a
+    batch_eval_results_*_ngram.csv (same reference song).
+
+    Returns (joined, report): report has per metric the MAE and Pearson r
+    of estimate vs sampled mean, next to the sampled seed-to-seed std.
+    """
+    import pandas as pd
+
+    keys = ["song", "section_idx", "n", "alpha"]
+    metrics = [m for m in ESTIMATED_METRICS if m in METRIC_COLS and m in batch_df]
+
+    sampled = batch_df.groupby(keys)[metrics].agg(["mean", "std"])
+    sampled.columns = [f"{m}_{stat}" for m, stat in sampled.columns]
+    est = estimates[estimates["ref_song"] == ref_song].set_index(keys)[metrics]
+    est.columns = [f"{m}_expected" for m in metrics]
+    joined = sampled.join(est, how="inner").reset_index()
+
+    report = []
+    for m in metrics:
+        diff = joined[f"{m}_expected"] - joined[f"{m}_mean"]
+        report.append({
+            "metric": m,
+            "runs": len(joined),
+            "mae": float(diff.abs().mean()),
+            "bias": float(diff.mean()),
+            "pearson_r": float(joined[f"{m}_expected"].corr(joined[f"{m}_mean"])),
+            "sampled_seed_std": float(joined[f"{m}_std"].mean()),
+        })
+    return joined, pd.DataFrame(report)
+
+
+# -----------------------------------------------------------
+# 4) CLI
+# -----------------------------------------------------------
+def main():
+    import time
+
+    import pandas as pd
+
+    from .corpus import load_songs
+
+    parser = argparse.ArgumentParser(description="Analytic n-gram metric estimates.")
+    parser.add_argument("--motif", required=True)
+    parser.add_argument("--ref-song", required=True, help="Reference song used by the batch run")
+    parser.add_argument("--csv", help="batch_eval_results_*_ngram.csv to compare against")
+    parser.add_argument("--ns", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--alphas", type=float, nargs="+", default=[0.001, 0.01, 0.1, 1.0])
+    parser.add_argument("--max-new-tokens", type=int, default=240)
+    parser.add_argument("--plug-in", action="store_true", help="Skip the covariance correction (faster)")
+    parser.add_argument("--out", help="Write the estimate grid to this CSV")
+    args = parser.parse_args()
+
+    root = Path(__file__).parent.parent
+    songs = load_songs(root / "thai_music_data")
+
+    batch_df, batch_songs = None, None
+    if args.csv:
+        batch_df = pd.read_csv(args.csv, encoding="utf-8-sig")
+        batch_songs = sorted(batch_df["song"].unique())
+
+    t0 = time.time()
+    estimates = estimate_grid(
+        songs, args.motif, ns=args.ns, alphas=args.alphas,
+        max_new_tokens=args.max_new_tokens, batch_songs=batch_songs,
+        second_order=not args.plug_in,
+    )
+    print(f"✅ {len(estimates):,} estimates in {time.time() - t0:.2f}s")
+
+    if args.out:
+        estimates.to_csv(args.out, index=False, encoding="utf-8-sig")
+        print(f"💾 → {args.out}")
+
+    if batch_df is not None:
+        _, report = compare_with_batch(estimates, batch_df, args.ref_song)
+        print(report.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# memorization.py
+# -----------------------------------------------------------
+# Copy / memorization metrics against the training corpus
+# - Suffix automaton over a motif's pitch sequences (built once)
+# - Per generated sequence, in O(len):
+#     longest copied span, coverage by copies ≥ k tokens,
+#     source song + offset of every maximal copied span
+# Complements the fixed-n corpus_overlap / single_overlap metrics.
+# -----------------------------------------------------------
+
+from bisect import bisect_left
+
+import numpy as np
+
+from .corpus import slots_to_tokens
+
+_SEP = -1   # between songs; never appears in a query, so copies cannot span two songs
+
+
+# -----------------------------------------------------------
+# 1) Build
+# -----------------------------------------------------------
+def build_copy_automaton(songs, motif=None):
+    """
+    Suffix automaton over every pitch_sequence in `songs`
+    (optionally only those of `motif`).
+
+    Returns an automaton dict:
+        next, link, length, firstpos   per-state lists
+        token_id                       token → int
+        song_ends, song_names          to map a text position back to its song
+    """
+    token_id = {}
+
+    nxt = [{}]
+    link = [-1]
+    length = [0]
+    firstpos = [-1]
+    last = 0
+
+    song_ends, song_names = [], []
+    pos = -1
+
+    def extend(c):
+        nonlocal last
+        cur = len(length)
+        nxt.append({})
+        link.append(0)
+        length.append(length[last] + 1)
+        firstpos.append(pos)
+
+        p = last
+        while p != -1 and c not in nxt[p]:
+            nxt[p][c] = cur
+            p = link[p]
+
+        if p != -1:
+            q = nxt[p][c]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = len(length)
+                nxt.append(dict(nxt[q]))
+                link.append(link[q])
+                length.append(length[p] + 1)
+                firstpos.append(firstpos[q])
+
+                while p != -1 and nxt[p].get(c) == q:
+                    nxt[p][c] = clone
+                    p = link[p]
+                link[q] = clone
+                link[cur] = clone
+
+        last = cur
+
+    for s in songs:
+        if motif is not None and s["motif"] != motif:
+            continue
+
+        for tok in s["pitch_sequence"]:
+            pos += 1
+            extend(token_id.setdefault(tok, len(token_id)))
+
+        pos += 1
+        extend(_SEP)
+        song_ends.append(pos)
+        song_names.append(s["song"])
+
+    return {
+        "next": nxt,
+        "link": link,
+        "length": length,
+        "firstpos": firstpos,
+        "token_id": token_id,
+        "song_ends": song_ends,
+        "song_names": song_names,
+        "song_starts": [0] + [e + 1 for e in song_ends[:-1]],
+    }
+
+
+# -----------------------------------------------------------
+# 2) Matching statistics
+# -----------------------------------------------------------
+def match_lengths(automaton, tokens):
+    """
+    ms[i] = length of the longest corpus substring ending at tokens[i].
+    Also returns the automaton state reached at every position.
+    Linear in len(tokens) (amortized).
+    """
+    nxt = automaton["next"]
+    link = automaton["link"]
+    length = automaton["length"]
+    token_id = automaton["token_id"]
+
+    ms = np.zeros(len(tokens), dtype=np.int64)
+    states = np.zeros(len(tokens), dtype=np.int64)
+
+    v, l = 0, 0
+    for i, tok in enumerate(tokens):
+        c = token_id.get(tok)
+        if c is None:
+            v, l = 0, 0
+        else:
+            while v and c not in nxt[v]:
+                v = link[v]
+                l = length[v]
+            if c in nxt[v]:
+                v = nxt[v][c]
+                l += 1
+            else:
+                v, l = 0, 0
+        ms[i] = l
+        states[i] = v
+
+    return ms, states
+
+
+def _source(automaton, state, span_len):
+    """(song, token offset in that song) of the first corpus occurrence."""
+    end = automaton["firstpos"][state]
+    song_idx = bisect_left(automaton["song_ends"], end)
+    start = end - span_len + 1
+    return automaton["song_names"][song_idx], start - automaton["song_starts"][song_idx]
+
+
+# -----------------------------------------------------------
+# 3) Metrics
+# -----------------------------------------------------------
+def copy_metrics(automaton, tokens, k=16, start=0):
+    """
+    tokens: generated token list (use slots_to_tokens() for slot lists)
+    k:      minimum copied-span length counted for coverage / spans
+    start:  first generated index (e.g. the seed fragment's token count);
+            spans are clipped to begin no earlier, so a copy running out
+            of the seed only counts its generated tail
+
+    Returns:
+        longest_copy      longest span found verbatim in the corpus
+        longest_source    song of that span
+        copy_coverage     fraction of tokens[start:] inside a copy of length ≥ k
+        spans             maximal copies ≥ k: (start, end, length, song, song_offset)
+
+    A seed copied from the corpus followed by 2 copied and 2 novel tokens:
+
+    >>> song = {"motif": "เขมร", "song": "a", "pitch_sequence": list("ดรมฟซลท")}
+    >>> auto = build_copy_automaton([song])
+    >>> copy_metrics(auto, list("ดรมฟซ") + ["<REST_1>", "<REST_2>"], k=2, start=3)["longest_copy"]
+    2
+    """
+    ms, states = match_lengths(automaton, tokens)
+    n = len(tokens)
+
+    result = {"longest_copy": 0, "longest_source": None, "copy_coverage": 0.0, "spans": []}
+    if n <= start:
+        return result
+
+    # a span ending at i is maximal when it does not continue at i + 1
+    ends = np.flatnonzero(ms[start:] > 0) + start
+    nxt_ms = np.append(ms[1:], 0)
+    maximal = ends[nxt_ms[ends] != ms[ends] + 1]
+
+    # clip every span to begin at `start` at the earliest
+    clipped = np.minimum(ms[maximal], maximal - start + 1)
+
+    if len(maximal):
+        i = int(np.argmax(clipped))
+        result["longest_copy"] = int(clipped[i])
+        result["longest_source"] = _source(automaton, int(states[maximal[i]]), int(clipped[i]))[0]
+
+    is_long = clipped >= k
+    long_ends, long_lens = maximal[is_long], clipped[is_long]
+    cover = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(cover, long_ends - long_lens + 1, 1)
+    np.add.at(cover, long_ends + 1, -1)
+    covered = np.cumsum(cover[:n]) > 0
+    result["copy_coverage"] = float(covered[start:].mean())
+
+    for e, L in zip(long_ends.tolist(), long_lens.tolist()):
+        song, offset = _source(automaton, int(states[e]), L)
+        result["spans"].append((e - L + 1, e, L, song, offset))
+
+    return result
+
+
+def copy_metric_row(automaton, combined_slots, k=16, fragment_len=0):
+    """
+    Flat columns to merge into a batch-eval row (see run_single_eval_ngram):
+        longest_copy, longest_copy_song, copy_coverage
+    fragment_len: number of leading slots that are the seed fragment.
+    """
+    start = len(slots_to_tokens(combined_slots[:fragment_len])) if fragment_len else 0
+    m = copy_metrics(automaton, slots_to_tokens(combined_slots), k=k, start=start)
+    return {
+        "longest_copy": m["longest_copy"],
+        "longest_copy_song": m["longest_source"],
+        f"copy_coverage_{k}": round(m["copy_coverage"], 6),
+    }
+
+
+def batch_copy_metrics(automaton, token_lists, k=16, start=0):
+    """
+    copy_metrics over many sequences; returns a pandas DataFrame (no span lists).
+    start: one seed length for all sequences, or a list with one per sequence.
+    """
+    import pandas as pd
+
+    starts = [start] * len(token_lists) if np.isscalar(start) else list(start)
+    rows = []
+    for tokens, st in zip(token_lists, starts):
+        m = copy_metrics(automaton, tokens, k=k, start=st)
+        rows.append({
+            "longest_copy": m["longest_copy"],
+            "longest_copy_song": m["longest_source"],
+            f"copy_coverage_{k}": m["copy_coverage"],
+            "n_copied_spans": len(m["spans"]),
+        })
+    return pd.DataFrame(rows)
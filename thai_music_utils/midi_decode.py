@@ -0,0 +1,304 @@
+# midi_decode.py
+# -----------------------------------------------------------
+# Decode Ranad MIDI files written by midi_ranad.generate_ranad_midi back into
+# Thai slot notation, and verify that every song's MIDI still matches its JSON
+#
+# MIDI layout being inverted (ticks_per_beat = 480):
+# - every note / dash is one 240-tick slot unit
+# - octave pairs: main pitch + pitch − 12 struck together
+# - กรอ rolls: 4 single strikes 120 ticks apart, then (dashes − 1) units
+#   + a 30-tick breath gap
+#
+# Usage (verify the whole corpus):
+#   python3 -m thai_music_utils.midi_decode --verify
+#
+# Usage (decode one file):
+#   python3 -m thai_music_utils.midi_decode --file path/to/song_v1.mid
+# -----------------------------------------------------------
+
+import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .midi_ranad import THAI_BASE, OCTAVE_OFFSET
+from .notation_utils import flatten_song_notation, normalize_octave_markers
+
+TICKS_PER_SLOT = 240
+ROLL_STEP = TICKS_PER_SLOT // 4            # note_on → note_off
+ROLL_SPACING = 2 * ROLL_STEP               # note_on → next note_on
+ROLL_SPAN = 7 * ROLL_STEP                  # 4 strikes incl. last note_off
+BREATH_GAP = TICKS_PER_SLOT // 8
+
+SLOTS_PER_BAR = 8
+UNITS_PER_SLOT = 4
+
+LOW_DOT = "ฺ"
+HIGH_DOT = "ํ"
+
+_UNIT_PATTERN = re.compile(r'([ดรมฟซลท])(\d)?|-')
+
+
+# -----------------------------------------------------------
+# 1) MIDI → events
+# -----------------------------------------------------------
+def read_note_ons(path):
+    """
+    Returns (ticks_per_beat, onset_ticks, pitches, end_tick) for the first
+    track, as NumPy arrays (note_on with velocity 0 counts as note_off).
+    """
+    from mido import MidiFile
+
+    midi = MidiFile(path)
+    track = midi.tracks[0]
+
+    deltas = np.fromiter((msg.time for msg in track), dtype=np.int64, count=len(track))
+    ticks = np.cumsum(deltas)
+    is_on = np.fromiter(
+        (msg.type == "note_on" and msg.velocity > 0 for msg in track),
+        dtype=bool, count=len(track),
+    )
+    notes = np.fromiter(
+        (getattr(msg, "note", -1) for msg in track),
+        dtype=np.int64, count=len(track),
+    )
+
+    end_tick = int(ticks[-1]) if len(ticks) else 0
+    return midi.ticks_per_beat, ticks[is_on], notes[is_on], end_tick
+
+
+def _pitch_lookup(global_transpose):
+    lookup = {}
+    for note, base in THAI_BASE.items():
+        for octave, offset in OCTAVE_OFFSET.items():
+            lookup[base + offset + global_transpose] = f"{note}{octave}"
+    return lookup
+
+
+def decode_events(onsets, pitches, end_tick, global_transpose=12):
+    """
+    Vectorized inverse of generate_ranad_midi's timing.
+
+    Returns (units, problems):
+        units    list of "-" or note+octave digit (e.g. "ด3")
+        problems list of strings for durations that do not land on the grid
+    """
+    problems = []
+    if len(onsets) == 0:
+        return ["-"] * (end_tick // TICKS_PER_SLOT), problems
+
+    # strikes at the same tick form one group (octave pair); main = highest
+    order = np.lexsort((pitches, onsets))
+    onsets, pitches = onsets[order], pitches[order]
+    group_start = np.flatnonzero(np.r_[True, onsets[1:] != onsets[:-1]])
+    group_tick = onsets[group_start]
+    group_main = np.maximum.reduceat(pitches, group_start)
+
+    # roll strikes follow each other every ROLL_SPACING ticks; keep the first
+    gap_before = np.r_[-1, np.diff(group_tick)]
+    gap_after = np.r_[np.diff(group_tick), -1]
+    in_roll = gap_before == ROLL_SPACING
+    is_roll = (gap_after == ROLL_SPACING) & ~in_roll
+
+    # a roll's main pitch is the highest of its alternating strikes
+    roll_id = np.cumsum(~in_roll) - 1
+    main = np.zeros(roll_id[-1] + 1, dtype=np.int64)
+    np.maximum.at(main, roll_id, group_main)
+
+    ev_tick = group_tick[~in_roll]
+    ev_roll = is_roll[~in_roll]
+    ev_dur = np.diff(np.r_[ev_tick, end_tick])
+
+    # normal: (1 + dashes) units; roll: ROLL_SPAN + (dashes − 1) units + gap
+    body = np.where(ev_roll, ev_dur - ROLL_SPAN - BREATH_GAP + TICKS_PER_SLOT, ev_dur - TICKS_PER_SLOT)
+    dashes, remainder = np.divmod(body, TICKS_PER_SLOT)
+
+    lookup = _pitch_lookup(global_transpose)
+    units = ["-"] * int(group_tick[0] // TICKS_PER_SLOT)
+
+    for i, (tick, p, d, r) in enumerate(zip(ev_tick.tolist(), main.tolist(), dashes.tolist(), remainder.tolist())):
+        note = lookup.get(p)
+        if note is None:
+            problems.append(f"tick {tick}: pitch {p} outside ranad range")
+            note = "?2"
+        if r or d < 0:
+            problems.append(f"tick {tick}: duration {int(ev_dur[i])} off the slot grid")
+        units.append(note)
+        units.extend(["-"] * max(int(d), 0))
+
+    return units, problems
+
+
+def decode_midi(path, global_transpose=12):
+    """MIDI file → (units, problems); see decode_events."""
+    tpb, onsets, pitches, end_tick = read_note_ons(path)
+    if tpb != 480:
+        return [], [f"ticks_per_beat {tpb} (expected 480)"]
+    return decode_events(onsets, pitches, end_tick, global_transpose)
+
+
+# -----------------------------------------------------------
+# 2) Units ↔ notation
+# -----------------------------------------------------------
+def sequence_to_units(sequence):
+    """generate_ranad_midi input string → units (unmarked notes → octave 2)."""
+    units = []
+    for m in _UNIT_PATTERN.finditer(sequence):
+        if m.group(0) == "-":
+            units.append("-")
+        else:
+            units.append(m.group(1) + (m.group(2) or "2"))
+    return units
+
+
+def units_to_slot(units):
+    """Units → one Thai slot string (octave digits back to ฺ / ํ)."""
+    out = []
+    for u in units:
+        if u == "-":
+            out.append("-")
+        else:
+            out.append(u[0] + {"1": LOW_DOT, "3": HIGH_DOT}.get(u[1], ""))
+    return "".join(out)
+
+
+def units_to_bars(units, slots_per_bar=SLOTS_PER_BAR):
+    """Units → bars of 4-unit slot strings."""
+    slots = [
+        units_to_slot(units[i:i + UNITS_PER_SLOT])
+        for i in range(0, len(units), UNITS_PER_SLOT)
+    ]
+    return [slots[i:i + slots_per_bar] for i in range(0, len(slots), slots_per_bar)]
+
+
+def midi_to_song_data(path, title=None, global_transpose=12):
+    """Decode a MIDI file into the song JSON schema (one section)."""
+    units, _ = decode_midi(path, global_transpose)
+    return {
+        "title": title or Path(path).stem,
+        "sections": [{"name": "Decoded", "bars": units_to_bars(units)}],
+    }
+
+
+# -----------------------------------------------------------
+# 3) Verification
+# -----------------------------------------------------------
+def expected_bar_units(song_data):
+    """Per-bar units exactly as generate_ranad_midi sees them."""
+    bars = []
+    for sec in song_data.get("sections", []):
+        for bar in sec.get("bars", []):
+            one = {"sections": [{"bars": [bar]}]}
+            seq = normalize_octave_markers("".join(flatten_song_notation(one)))
+            bars.append(sequence_to_units(seq))
+    return bars
+
+
+def _slots(units):
+    return [units_to_slot(units[i:i + UNITS_PER_SLOT]) for i in range(0, len(units), UNITS_PER_SLOT)]
+
+
+def verify_song(json_path, midi_path, global_transpose=12):
+    """
+    Compare a song's JSON against its MIDI.
+
+    Returns {"song", "midi", "ok", "bars", "bad_bars", "problems"}; midi is
+    the MIDI file name (a song folder can hold several versions), bad_bars
+    holds (bar_index, expected_slots, decoded_slots) for each mismatching bar.
+    """
+    import json
+
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    expected = expected_bar_units(data)
+    decoded, problems = decode_midi(midi_path, global_transpose)
+
+    bad_bars = []
+    pos = 0
+    for bi, exp in enumerate(expected):
+        got = decoded[pos:pos + len(exp)]
+        if got != exp:
+            bad_bars.append((bi, _slots(exp), _slots(got)))
+        pos += len(exp)
+
+    if pos != len(decoded):
+        problems.append(f"length: expected {pos} units, decoded {len(decoded)}")
+
+    return {
+        "song": Path(json_path).parent.parent.name,
+        "midi": Path(midi_path).name,
+        "ok": not bad_bars and not problems,
+        "bars": len(expected),
+        "bad_bars": bad_bars,
+        "problems": problems,
+    }
+
+
+def _verify_job(args):
+    return verify_song(*args)
+
+
+def find_pairs(songs_root):
+    """(json_path, midi_path) for every song folder that has both."""
+    pairs = []
+    for midi_path in sorted(Path(songs_root).rglob("midi/*.mid")):
+        json_dir = midi_path.parent.parent / "json"
+        jsons = sorted(json_dir.glob("*.json")) if json_dir.exists() else []
+        if jsons:
+            pairs.append((str(jsons[0]), str(midi_path)))
+    return pairs
+
+
+def verify_corpus(songs_root, workers=None, global_transpose=12):
+    """Round-trip every (json, midi) pair in parallel; returns a list of reports."""
+    jobs = [(j, m, global_transpose) for j, m in find_pairs(songs_root)]
+    if workers == 1:
+        return [_verify_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_verify_job, jobs))
+
+
+# -----------------------------------------------------------
+# 4) CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Decode Ranad MIDI / verify MIDI ↔ JSON round trip.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--file", help="Decode a single .mid file to slot notation")
+    group.add_argument("--verify", action="store_true", help="Round-trip every song under songs/")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes")
+    parser.add_argument("--max-bars", type=int, default=3, help="Mismatching bars shown per song")
+    args = parser.parse_args()
+
+    songs_root = Path(__file__).parent.parent / "thai_music_data" / "songs"
+
+    if args.file:
+        units, problems = decode_midi(args.file)
+        for bar in units_to_bars(units):
+            print("[ " + ", ".join(f'"{s}"' for s in bar) + " ]")
+        for p in problems:
+            print(f"⚠️ {p}")
+        return
+
+    reports = verify_corpus(songs_root, workers=args.workers)
+    n_bad = 0
+    for r in reports:
+        if r["ok"]:
+            print(f"  ✓  {r['song']} / {r['midi']}  ({r['bars']} bars)")
+            continue
+        n_bad += 1
+        print(f"  ✗  {r['song']} / {r['midi']}  {len(r['bad_bars'])}/{r['bars']} bars differ")
+        for bi, exp, got in r["bad_bars"][:args.max_bars]:
+            print(f"       bar {bi}:\n         json {', '.join(exp)}\n         midi {', '.join(got)}")
+        for p in r["problems"][:args.max_bars]:
+            print(f"       {p}")
+
+    print(f"\nDone — {len(reports) - n_bad}/{len(reports)} MIDI file(s) match.")
+    raise SystemExit(1 if n_bad else 0)
+
+
+if __name__ == "__main__":
+    main()
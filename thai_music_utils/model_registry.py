@@ -0,0 +1,265 @@
+# model_registry.py
+# -----------------------------------------------------------
+# Manifest of the trained LSTM checkpoints in thai_music_data/weights/
+#
+# Each entry stores, next to the weights file name:
+# - vocab + token_to_id the model was trained with
+# - model config (vocab_size, embed_dim, hidden_dim, num_layers, dropout)
+# - seq_len, motif, training corpus hash and the weights' sha1
+#
+# so loading a model for generation never needs the song corpus. Tensors
+# are memory-mapped (torch.load(mmap=True)) into a model built on the meta
+# device, and loaded models are kept in a small in-process LRU keyed by
+# motif / config.
+#
+# Usage (register the notebook checkpoints once, from the corpus):
+#   python3 -m thai_music_utils.model_registry --bootstrap
+#
+# Usage (register a new checkpoint / list):
+#   python3 -m thai_music_utils.model_registry --register lstm_khmer_32.pth --motif เขมร --seq-len 32
+#   python3 -m thai_music_utils.model_registry --list
+#
+# In code:
+#   model, entry = get_model(name="lstm_pitch_only_khmer_35")
+#   model, entry = get_model(motif="เขมร", seq_len=16)      # newest match
+# -----------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_WEIGHTS_DIR = Path(__file__).parent.parent / "thai_music_data" / "weights"
+MANIFEST_NAME = "manifest.json"
+MAX_LOADED = 4
+
+# LSTMLanguageModel sizes used by every notebook
+DEFAULT_CONFIG = {"embed_dim": 64, "hidden_dim": 128, "num_layers": 2, "dropout": 0.25}
+
+# checkpoints saved by the Stage 3 LSTM notebooks: file → (motif, SEQ_LEN)
+NOTEBOOK_CHECKPOINTS = {
+    "lstm_pitch_only_khmer_1.pth": ("เขมร", 16),
+    "lstm_pitch_only_khmer_35.pth": ("เขมร", 16),
+    "lstm_pitch_only_khmer_30_32.pth": ("เขมร", 32),
+    "lstm_pitch_only_laos_30.pth": ("ลาว", 16),
+}
+
+_loaded = OrderedDict()        # LRU: key → (model, entry)
+
+
+# -----------------------------------------------------------
+# 1) Manifest
+# -----------------------------------------------------------
+def load_manifest(weights_dir=DEFAULT_WEIGHTS_DIR):
+    path = Path(weights_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"models": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, weights_dir=DEFAULT_WEIGHTS_DIR):
+    path = Path(weights_dir) / MANIFEST_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def register(weights_path, vocab, motif, seq_len, name=None, corpus_hash=None,
+             config=None, weights_dir=DEFAULT_WEIGHTS_DIR, **extra):
+    """
+    Add (or replace) a manifest entry for weights_path, which must live in
+    weights_dir. config defaults to the notebook LSTMLanguageModel sizes;
+    extra keys (epochs, notes, …) are stored as is. Returns the entry.
+    """
+    weights_dir = Path(weights_dir)
+    weights_path = Path(weights_path)
+    if not weights_path.is_absolute():
+        weights_path = weights_dir / weights_path
+    if weights_path.parent.resolve() != weights_dir.resolve():
+        raise ValueError(f"{weights_path} is not inside {weights_dir}")
+
+    vocab = list(vocab)
+    model_config = dict(DEFAULT_CONFIG)
+    model_config.update(config or {})
+    model_config["vocab_size"] = len(vocab)
+
+    entry = {
+        "file": weights_path.name,
+        "motif": motif,
+        "seq_len": int(seq_len),
+        "vocab": vocab,
+        "token_to_id": {tok: i for i, tok in enumerate(vocab)},
+        "config": model_config,
+        "corpus_hash": corpus_hash,
+        "sha1": file_sha1(weights_path),
+        "registered": time.time(),
+        **extra,
+    }
+
+    manifest = load_manifest(weights_dir)
+    manifest["models"].pop(name or weights_path.stem, None)     # re-registered → newest
+    manifest["models"][name or weights_path.stem] = entry
+    save_manifest(manifest, weights_dir)
+    return entry
+
+
+def register_from_corpus(weights_path, data_root, motif, seq_len, name=None,
+                         weights_dir=DEFAULT_WEIGHTS_DIR, **extra):
+    """
+    register() with the vocab and corpus hash the notebooks trained on:
+    build_vocab over the songs of `motif` only.
+    """
+    from .corpus import build_vocab, load_songs
+    from .phrase_index import corpus_hash
+
+    songs = load_songs(data_root, motif=motif)
+    vocab = build_vocab(songs)[0]
+    return register(weights_path, vocab, motif, seq_len, name=name,
+                    corpus_hash=corpus_hash(songs), weights_dir=weights_dir, **extra)
+
+
+def find(manifest, name=None, motif=None, seq_len=None):
+    """
+    Name of the manifest entry matching the query: `name` exactly, else the
+    most recently registered entry with that motif / seq_len (KeyError
+    when nothing matches).
+    """
+    models = manifest["models"]
+    if name is not None:
+        if name not in models:
+            raise KeyError(f"No registered model named {name!r}")
+        return name
+
+    hits = [
+        key for key, e in models.items()
+        if (motif is None or e["motif"] == motif) and (seq_len is None or e["seq_len"] == seq_len)
+    ]
+    if not hits:
+        raise KeyError(f"No registered model matches motif={motif!r}, seq_len={seq_len!r}")
+    # manifest order breaks ties (entries are appended as they are registered)
+    order = {key: i for i, key in enumerate(models)}
+    return max(hits, key=lambda key: (models[key].get("registered", 0.0), order[key]))
+
+
+# -----------------------------------------------------------
+# 2) Loading
+# -----------------------------------------------------------
+def load_state_dict(path, mmap=True):
+    """
+    state_dict on CPU, memory-mapped when the file and torch allow it
+    (zip checkpoint format, torch ≥ 2.1); a plain load otherwise.
+    """
+    import torch
+
+    if mmap:
+        try:
+            return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        except (TypeError, RuntimeError):
+            pass
+    return torch.load(path, map_location="cpu")
+
+
+def build_model(entry, weights_dir=DEFAULT_WEIGHTS_DIR, device="cpu", mmap=True):
+    """
+    LSTMLanguageModel for a manifest entry, in eval mode. Parameters are
+    created on the meta device and then assigned the (mapped) tensors, so
+    no throwaway random init is allocated.
+    """
+    import torch
+
+    from .lstm_model import LSTMLanguageModel
+
+    state = load_state_dict(Path(weights_dir) / entry["file"], mmap=mmap)
+    with torch.device("meta"):
+        model = LSTMLanguageModel(**entry["config"])
+    model.load_state_dict(state, assign=True)
+    return model.to(device).eval()
+
+
+def get_model(name=None, motif=None, seq_len=None, device="cpu",
+              weights_dir=DEFAULT_WEIGHTS_DIR, mmap=True):
+    """
+    (model, entry) for a registered checkpoint, served from the LRU of up
+    to MAX_LOADED models. entry["token_to_id"] / entry["vocab"] are all
+    generation needs besides the model.
+    """
+    manifest = load_manifest(weights_dir)
+    entry = manifest["models"][find(manifest, name, motif, seq_len)]
+
+    key = (
+        entry["motif"],
+        entry["seq_len"],
+        json.dumps(entry["config"], sort_keys=True),
+        entry["sha1"],
+        str(device),
+    )
+    if key in _loaded:
+        _loaded.move_to_end(key)
+        return _loaded[key]
+
+    model = build_model(entry, weights_dir, device, mmap)
+    _loaded[key] = (model, entry)
+    while len(_loaded) > MAX_LOADED:
+        _loaded.popitem(last=False)
+    return model, entry
+
+
+def clear_cache():
+    _loaded.clear()
+
+
+# -----------------------------------------------------------
+# 3) CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="LSTM checkpoint registry.")
+    parser.add_argument("--list", action="store_true", help="List registered models")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="Register the Stage 3 notebook checkpoints")
+    parser.add_argument("--register", metavar="FILE", help="Weights file in the weights dir")
+    parser.add_argument("--motif")
+    parser.add_argument("--seq-len", type=int)
+    parser.add_argument("--name")
+    parser.add_argument("--epochs", type=int)
+    parser.add_argument("--weights-dir", default=str(DEFAULT_WEIGHTS_DIR))
+    args = parser.parse_args()
+
+    data_root = Path(__file__).parent.parent / "thai_music_data"
+
+    if args.bootstrap:
+        for file, (motif, seq_len) in NOTEBOOK_CHECKPOINTS.items():
+            if not (Path(args.weights_dir) / file).exists():
+                print(f"⚠️  {file} not found — skipping.")
+                continue
+            entry = register_from_corpus(file, data_root, motif, seq_len,
+                                         weights_dir=args.weights_dir)
+            print(f"✅ {file}: {motif}, seq_len={seq_len}, vocab={entry['config']['vocab_size']}")
+
+    if args.register:
+        if not args.motif or not args.seq_len:
+            parser.error("--register needs --motif and --seq-len")
+        extra = {"epochs": args.epochs} if args.epochs is not None else {}
+        register_from_corpus(args.register, data_root, args.motif, args.seq_len,
+                             name=args.name, weights_dir=args.weights_dir, **extra)
+        print(f"✅ registered {args.register}")
+
+    if args.list or not (args.bootstrap or args.register):
+        for key, e in load_manifest(args.weights_dir)["models"].items():
+            print(f"{key:<36} {e['motif']:<8} seq_len={e['seq_len']:<3} "
+                  f"vocab={e['config']['vocab_size']:<3} {e['file']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# ngram_model.py
+# -----------------------------------------------------------
+# Count-based n-gram LM over the pitch/rest token vocabulary
+# - dense NumPy count arrays for every order 1..n_max
+#   (vocab is ~11 tokens, so V^4 is only ~15k cells)
+# - held_out(): subtract one song's counts in place and add
+#   them back afterwards — O(song length) leave-one-out models
+# - smoothing: laplace (as in the Stage 3 notebooks),
+#   witten_bell and absolute (interpolated, down to an
+#   add-alpha unigram)
+# - perplexity + generation (same sampling as
+#   generate_from_fragment_ngram for laplace)
+# -----------------------------------------------------------
+
+from contextlib import contextmanager
+
+import numpy as np
+
+from .corpus import build_vocab, normalize_token
+
+SMOOTHING_METHODS = ("laplace", "witten_bell", "absolute")
+
+
+# -----------------------------------------------------------
+# 1) Counts
+# -----------------------------------------------------------
+def _ngram_keys(ids, k, V):
+    """Base-V keys of every k-gram in ids (first token most significant)."""
+    if len(ids) < k:
+        return np.zeros(0, dtype=np.int64)
+    code = ids[: len(ids) - k + 1].copy()
+    for j in range(1, k):
+        code = code * V + ids[j: len(ids) - k + 1 + j]
+    return code
+
+
+def encode(model, tokens):
+    """Token list → int64 id array (unknown tokens raise KeyError)."""
+    t2i = model["token_to_id"]
+    return np.fromiter((t2i[t] for t in tokens), dtype=np.int64, count=len(tokens))
+
+
+def build_ngram_counts(songs, n_max=4, motif=None, vocab=None):
+    """
+    Count every k-gram (k = 1..n_max) inside each song's pitch_sequence
+    (never across songs, like build_ngram_lm).
+
+    vocab: token order for ids; default build_vocab(songs), i.e. the
+           sorted vocab of the Stage 3 notebooks.
+
+    Returns a model dict: vocab, token_to_id, V, n_max, counts[k].
+    """
+    if vocab is None:
+        vocab = build_vocab(songs)[0]
+    V = len(vocab)
+
+    model = {
+        "vocab": list(vocab),
+        "token_to_id": {tok: i for i, tok in enumerate(vocab)},
+        "V": V,
+        "n_max": n_max,
+        "counts": [None] + [np.zeros(V ** k, dtype=np.int64) for k in range(1, n_max + 1)],
+        "motif": motif,
+    }
+
+    for s in songs:
+        if motif is not None and s["motif"] != motif:
+            continue
+        add_song(model, s["pitch_sequence"])
+
+    return model
+
+
+def add_song(model, tokens, sign=1):
+    """Add (sign=1) or subtract (sign=-1) one song's counts in place."""
+    ids = encode(model, tokens)
+    for k in range(1, model["n_max"] + 1):
+        keys = _ngram_keys(ids, k, model["V"])
+        np.add.at(model["counts"][k], keys, sign)
+
+
+@contextmanager
+def held_out(model, tokens):
+    """
+    Leave-one-out view of the model: the song's counts are subtracted
+    on entry and restored on exit (O(len(tokens) × n_max) each way).
+
+        with held_out(model, song["pitch_sequence"]):
+            ppl = perplexity(model, song["pitch_sequence"], n=3)
+    """
+    add_song(model, tokens, sign=-1)
+    try:
+        yield model
+    finally:
+        add_song(model, tokens, sign=1)
+
+
+def ngram_set(model, k):
+    """Set of k-gram tuples with a non-zero count (cf. build_corpus_ngram_set)."""
+    V, vocab = model["V"], model["vocab"]
+    out = set()
+    for key in np.flatnonzero(model["counts"][k]).tolist():
+        gram = []
+        for _ in range(k):
+            key, t = divmod(key, V)
+            gram.append(vocab[t])
+        out.add(tuple(reversed(gram)))
+    return out
+
+
+# -----------------------------------------------------------
+# 2) Smoothed next-token distributions
+# -----------------------------------------------------------
+def next_token_probs(model, histories, n=3, alpha=0.01, method="laplace", discount=0.75):
+    """
+    histories: int array (m × (n-1)) of token ids, oldest first
+    method:    laplace     (c(h,w) + α) / (c(h) + αV) at order n only
+               witten_bell interpolated Witten-Bell, orders n … 2
+               absolute    interpolated absolute discounting (discount D)
+               the interpolated methods bottom out in an add-α unigram
+
+    Returns an (m × V) array of probabilities.
+    """
+    if method not in SMOOTHING_METHODS:
+        raise ValueError(f"Unknown smoothing method: {method!r}")
+    if not 1 <= n <= model["n_max"]:
+        raise ValueError(f"n must be in 1..{model['n_max']}, got {n}")
+
+    V, counts = model["V"], model["counts"]
+    m = len(histories)
+    histories = np.asarray(histories, dtype=np.int64).reshape(m, n - 1)
+
+    def rows(k):
+        h = np.zeros(m, dtype=np.int64)
+        for j in range(n - k, n - 1):
+            h = h * V + histories[:, j]
+        return counts[k].reshape(-1, V)[h].astype(np.float64)
+
+    if method == "laplace":
+        c = rows(n) if n > 1 else np.broadcast_to(counts[1].astype(np.float64), (m, V))
+        return (c + alpha) / (c.sum(axis=1, keepdims=True) + alpha * V)
+
+    unigram = (counts[1] + alpha) / (counts[1].sum() + alpha * V)
+    p = np.broadcast_to(unigram, (m, V))
+
+    for k in range(2, n + 1):
+        c = rows(k)
+        total = c.sum(axis=1, keepdims=True)
+        types = (c > 0).sum(axis=1, keepdims=True)
+        seen = total > 0
+        safe = np.where(seen, total, 1.0)
+
+        if method == "witten_bell":
+            higher = (c + types * p) / (safe + types)
+        else:
+            higher = (np.maximum(c - discount, 0.0) + discount * types * p) / safe
+        p = np.where(seen, higher, p)
+
+    return p
+
+
+# -----------------------------------------------------------
+# 3) Perplexity
+# -----------------------------------------------------------
+def log_likelihood(model, tokens, n=3, alpha=0.01, method="laplace", start=None, **kwargs):
+    """
+    Sum of natural-log probabilities of tokens[start:], each conditioned on
+    its n-1 predecessors. start defaults to n_max - 1, so every order is
+    scored on the same positions. Returns (log_prob, n_scored).
+    """
+    ids = encode(model, tokens)
+    if start is None:
+        start = model["n_max"] - 1
+    start = max(start, n - 1)
+    if len(ids) <= start:
+        return 0.0, 0
+
+    if n > 1:
+        windows = np.lib.stride_tricks.sliding_window_view(ids, n - 1)
+        histories = windows[start - n + 1: len(ids) - n + 1]
+    else:
+        histories = np.zeros((len(ids) - start, 0), dtype=np.int64)
+
+    probs = next_token_probs(model, histories, n, alpha, method, **kwargs)
+    target = ids[start:]
+    logp = np.log(probs[np.arange(len(target)), target])
+    return float(logp.sum()), len(target)
+
+
+def perplexity(model, tokens, n=3, alpha=0.01, method="laplace", start=None, **kwargs):
+    """exp(−mean log p) over tokens[start:] (see log_likelihood)."""
+    logp, count = log_likelihood(model, tokens, n, alpha, method, start, **kwargs)
+    return float(np.exp(-logp / count)) if count else float("nan")
+
+
+# -----------------------------------------------------------
+# 4) Generation
+# -----------------------------------------------------------
+def generate(model, fragment_tokens, n=3, max_new_tokens=240, alpha=0.01,
+             method="laplace", seed=None, cache=None, **kwargs):
+    """
+    Counterpart of generate_from_fragment_ngram (without printing).
+    With method="laplace" it draws the same samples for the same
+    counts, vocab and seed.
+
+    cache: optional dict reused across calls with the same model state
+           and (n, alpha, method); memoizes one CDF per context.
+
+    Returns seed (n-1 tokens) + new tokens; pass seq_len=n-1 when combining.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = model["vocab"]
+
+    normalized = []
+    for tok in fragment_tokens:
+        normalized.extend(normalize_token(tok))
+
+    ctx_len = n - 1
+    if len(normalized) < ctx_len:
+        normalized = ["<REST_1>"] * (ctx_len - len(normalized)) + normalized
+    seed_toks = normalized[len(normalized) - ctx_len:]
+
+    history = encode(model, seed_toks).tolist()
+    generated = list(seed_toks)
+    if cache is None:
+        cache = {}
+
+    for _ in range(max_new_tokens):
+        ctx = tuple(history[len(history) - ctx_len:]) if ctx_len else ()
+        cdf = cache.get(ctx)
+        if cdf is None:
+            probs = next_token_probs(model, [ctx], n, alpha, method, **kwargs)[0]
+            probs /= probs.sum()
+            cdf = probs.cumsum()
+            cdf /= cdf[-1]
+            cache[ctx] = cdf
+
+        # the draw Generator.choice(V, p=probs) makes, minus its validation
+        idx = int(cdf.searchsorted(rng.random(), side="right"))
+        generated.append(vocab[idx])
+        history.append(idx)
+
+    return generated
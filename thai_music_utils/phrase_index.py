@@ -0,0 +1,426 @@
+# phrase_index.py
+# -----------------------------------------------------------
+# Suffix-array search index over the integer-encoded song corpus
+#
+# Two streams are indexed:
+# - pitch    : pitch/rest tokens (same vocabulary as corpus.normalize_token)
+# - interval : octave-aware scale-step intervals between consecutive notes
+#              (rests skipped) → transposition-invariant contour search
+#
+# Each stream has a suffix array + LCP array, and every position maps back
+# to (song, section, bar, slot). Queries are O(m log N) binary searches.
+#
+# Usage (build + persist next to the data):
+#   python3 -m thai_music_utils.phrase_index --build
+#
+# Usage (search):
+#   python3 -m thai_music_utils.phrase_index --query ดํลซฟ ซฟดฟ
+#   python3 -m thai_music_utils.phrase_index --query ดํลซฟ ซฟดฟ --contour
+# -----------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+from .corpus import THAI_NOTES, REST_TOKENS, load_songs, normalize_token
+from .preprocessing import flatten_song_data
+
+LOW_DOT = "ฺ"
+HIGH_DOT = "ํ"
+
+DEFAULT_INDEX_PATH = Path(__file__).parent.parent / "thai_music_data" / "index" / "phrase_index.npz"
+
+# 0 is the song separator, so no match can cross two songs
+_TOKEN_ID = {tok: i + 1 for i, tok in enumerate(list(THAI_NOTES) + REST_TOKENS)}
+_STEP = {p: i for i, p in enumerate(THAI_NOTES)}
+_INTERVAL_BIAS = 64   # interval + bias > 0 for every realistic jump
+
+_NOTE_OCTAVE = re.compile(rf"([{THAI_NOTES}])([{LOW_DOT}{HIGH_DOT}123])?")
+
+
+# -----------------------------------------------------------
+# 1) Slot parsing
+# -----------------------------------------------------------
+def _slot_octaves(slot):
+    """Octave (1/2/3) of every note in a slot, in the order normalize_token emits them."""
+    octaves = []
+    for note, mark in _NOTE_OCTAVE.findall(slot if isinstance(slot, str) else ""):
+        if mark in (LOW_DOT, "1"):
+            octaves.append(1)
+        elif mark in (HIGH_DOT, "3"):
+            octaves.append(3)
+        else:
+            octaves.append(2)
+    return octaves
+
+
+def _bar_slots(bar):
+    """Flatten one bar (plain list, นำ/ตาม dict, or list with dict items) to slot strings."""
+    if isinstance(bar, dict):
+        return [s for key in ("นำ", "ตาม") for s in bar.get(key, [])]
+
+    slots = []
+    for item in bar:
+        if isinstance(item, str):
+            slots.append(item)
+        elif isinstance(item, dict):
+            for v in item.values():
+                slots.extend(v if isinstance(v, list) else [v])
+        elif isinstance(item, list):
+            slots.extend(item)
+    return slots
+
+
+def slots_to_steps(slots):
+    """Absolute scale steps (octave-aware) of every note in a slot list."""
+    steps = []
+    for slot in slots:
+        notes = [t for t in normalize_token(slot) if t in _STEP]
+        for note, octave in zip(notes, _slot_octaves(slot)):
+            steps.append(_STEP[note] + 7 * (octave - 2))
+    return steps
+
+
+# -----------------------------------------------------------
+# 2) Suffix array + LCP
+# -----------------------------------------------------------
+def suffix_array(text):
+    """
+    Prefix-doubling suffix array, vectorized with NumPy.
+    O(N log² N) worst case, but each round is a single lexsort.
+    """
+    n = len(text)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    rank = np.asarray(text, dtype=np.int64)
+    k = 1
+    while True:
+        second = np.full(n, -1, dtype=np.int64)
+        second[: n - k] = rank[k:]
+        sa = np.lexsort((second, rank))
+
+        r, s = rank[sa], second[sa]
+        new_rank = np.empty(n, dtype=np.int64)
+        new_rank[sa] = np.concatenate(([0], np.cumsum((r[1:] != r[:-1]) | (s[1:] != s[:-1]))))
+        rank = new_rank
+
+        if rank.max() == n - 1 or k >= n:
+            return sa
+        k *= 2
+
+
+def lcp_array(text, sa):
+    """
+    Kasai's algorithm: lcp[i] = longest common prefix of suffixes
+    sa[i - 1] and sa[i] (lcp[0] = 0). Separators (0) never match.
+    """
+    n = len(text)
+    text = np.asarray(text).tolist()
+    rank = [0] * n
+    for i, p in enumerate(sa.tolist()):
+        rank[p] = i
+
+    sa_list = sa.tolist()
+    lcp = [0] * n
+    h = 0
+    for i in range(n):
+        r = rank[i]
+        if r == 0:
+            h = 0
+            continue
+        j = sa_list[r - 1]
+        while i + h < n and j + h < n and text[i + h] == text[j + h] and text[i + h] != 0:
+            h += 1
+        lcp[r] = h
+        if h > 0:
+            h -= 1
+    return np.array(lcp, dtype=np.int64)
+
+
+# -----------------------------------------------------------
+# 3) Build
+# -----------------------------------------------------------
+def _song_key(s):
+    """motif/song/file.json — the song's path relative to songs/."""
+    return f"{s['motif']}/{s['song']}/{Path(s['path']).name}"
+
+
+def corpus_hash(songs):
+    """
+    Stable hash of the song JSONs an index was built from: each song's
+    path relative to songs/ plus its content, so the same corpus hashes
+    the same from any checkout or spelling of data_root.
+    """
+    h = hashlib.sha1()
+    for s in sorted(songs, key=_song_key):
+        h.update(_song_key(s).encode("utf-8"))
+        h.update(json.dumps(s["data"], ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def build_index(songs):
+    """
+    songs: list of song dicts from corpus.load_songs()
+
+    Returns an index dict with, for each stream ("pitch", "interval"):
+        text, sa, lcp       int arrays
+        loc                 (N × 4) song_idx, section_idx, bar_idx, slot_idx
+    plus "songs" (motif, song, path, section names) and "corpus_hash".
+    """
+    pitch_text, pitch_loc = [], []
+    iv_text, iv_loc = [], []
+    meta = []
+
+    for song_idx, s in enumerate(songs):
+        data = flatten_song_data(s["data"])
+        meta.append({
+            "motif": s["motif"],
+            "song": s["song"],
+            "path": s["path"],
+            "sections": [sec.get("name", "") for sec in data["sections"]],
+        })
+
+        prev_step = None
+        for sec_idx, sec in enumerate(data["sections"]):
+            for bar_idx, bar in enumerate(sec.get("bars", [])):
+                for slot_idx, slot in enumerate(_bar_slots(bar)):
+                    loc = (song_idx, sec_idx, bar_idx, slot_idx)
+
+                    for tok in normalize_token(slot):
+                        pitch_text.append(_TOKEN_ID[tok])
+                        pitch_loc.append(loc)
+
+                    for step in slots_to_steps([slot]):
+                        if prev_step is not None:
+                            # location of an interval = its first note
+                            iv_text.append(step - prev_step[0] + _INTERVAL_BIAS)
+                            iv_loc.append(prev_step[1])
+                        prev_step = (step, loc)
+
+        pitch_text.append(0)
+        pitch_loc.append((song_idx, -1, -1, -1))
+        iv_text.append(0)
+        iv_loc.append((song_idx, -1, -1, -1))
+
+    index = {"songs": meta, "corpus_hash": corpus_hash(songs)}
+    for name, text, loc in (("pitch", pitch_text, pitch_loc), ("interval", iv_text, iv_loc)):
+        text = np.array(text, dtype=np.int64)
+        sa = suffix_array(text)
+        index[name] = {
+            "text": text,
+            "sa": sa,
+            "lcp": lcp_array(text, sa),
+            "loc": np.array(loc, dtype=np.int32).reshape(-1, 4),
+        }
+    return index
+
+
+# -----------------------------------------------------------
+# 4) Persistence
+# -----------------------------------------------------------
+def save_index(index, path=DEFAULT_INDEX_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    arrays = {}
+    for name in ("pitch", "interval"):
+        for key, arr in index[name].items():
+            arrays[f"{name}_{key}"] = arr
+
+    meta = json.dumps({"songs": index["songs"], "corpus_hash": index["corpus_hash"]}, ensure_ascii=False)
+    np.savez_compressed(path, meta=np.array(meta), **arrays)
+    return path
+
+
+def load_index(path=DEFAULT_INDEX_PATH):
+    with np.load(path) as z:
+        meta = json.loads(str(z["meta"]))
+        index = {"songs": meta["songs"], "corpus_hash": meta["corpus_hash"]}
+        for name in ("pitch", "interval"):
+            index[name] = {key: z[f"{name}_{key}"] for key in ("text", "sa", "lcp", "loc")}
+    return index
+
+
+def load_or_build_index(data_root, path=DEFAULT_INDEX_PATH):
+    """Load the persisted index, rebuilding it when the corpus changed."""
+    songs = load_songs(data_root)
+    path = Path(path)
+
+    if path.exists():
+        index = load_index(path)
+        if index["corpus_hash"] == corpus_hash(songs):
+            return index
+
+    index = build_index(songs)
+    save_index(index, path)
+    return index
+
+
+# -----------------------------------------------------------
+# 5) Search
+# -----------------------------------------------------------
+def _compare(text, pos, pattern):
+    """Compare suffix text[pos:] against pattern on its first len(pattern) symbols."""
+    seg = text[pos:pos + len(pattern)]
+    m = min(len(seg), len(pattern))
+    diff = np.flatnonzero(seg[:m] != pattern[:m])
+    if len(diff):
+        i = diff[0]
+        return -1 if seg[i] < pattern[i] else 1
+    return 0 if len(seg) == len(pattern) else -1
+
+
+def _sa_range(stream, pattern):
+    """[lo, hi) range of suffixes starting with pattern — two binary searches."""
+    text, sa = stream["text"], stream["sa"]
+
+    lo, hi = 0, len(sa)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _compare(text, sa[mid], pattern) < 0:
+            lo = mid + 1
+        else:
+            hi = mid
+    start = lo
+
+    hi = len(sa)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _compare(text, sa[mid], pattern) <= 0:
+            lo = mid + 1
+        else:
+            hi = mid
+    return start, lo
+
+
+def _format_hits(index, stream, positions):
+    hits = []
+    for song_idx, sec_idx, bar_idx, slot_idx in stream["loc"][np.sort(positions)].tolist():
+        song = index["songs"][song_idx]
+        hits.append({
+            "motif": song["motif"],
+            "song": song["song"],
+            "section_idx": sec_idx,
+            "section": song["sections"][sec_idx],
+            "bar": bar_idx,
+            "slot": slot_idx,
+        })
+    return hits
+
+
+def search(index, phrase):
+    """
+    Exact pitch/rest search.
+
+    phrase: list of slot strings (e.g. ["ดํลซฟ", "ซฟดฟ"]); octave marks
+            are ignored, rests must match after REST compression
+    Returns a list of location dicts (first token of each occurrence).
+    """
+    tokens = [t for slot in phrase for t in normalize_token(slot)]
+    pattern = np.array([_TOKEN_ID[t] for t in tokens], dtype=np.int64)
+    if len(pattern) == 0:
+        return []
+
+    stream = index["pitch"]
+    lo, hi = _sa_range(stream, pattern)
+    return _format_hits(index, stream, stream["sa"][lo:hi])
+
+
+def search_contour(index, phrase):
+    """
+    Transposition-invariant search on the interval sequence of the phrase.
+    Rests are skipped, so the rhythm may differ between matches.
+    Returns a list of location dicts (first note of each occurrence).
+    """
+    steps = slots_to_steps(phrase)
+    if len(steps) < 2:
+        return []
+    pattern = np.diff(np.array(steps, dtype=np.int64)) + _INTERVAL_BIAS
+
+    stream = index["interval"]
+    lo, hi = _sa_range(stream, pattern)
+    return _format_hits(index, stream, stream["sa"][lo:hi])
+
+
+def count(index, phrase, contour=False):
+    """Number of occurrences without materializing locations."""
+    if contour:
+        steps = slots_to_steps(phrase)
+        if len(steps) < 2:
+            return 0
+        stream = index["interval"]
+        pattern = np.diff(np.array(steps, dtype=np.int64)) + _INTERVAL_BIAS
+    else:
+        stream = index["pitch"]
+        pattern = np.array([_TOKEN_ID[t] for slot in phrase for t in normalize_token(slot)], dtype=np.int64)
+        if len(pattern) == 0:
+            return 0
+
+    lo, hi = _sa_range(stream, pattern)
+    return hi - lo
+
+
+def longest_repeats(index, min_len=16, stream="pitch", top=20):
+    """
+    Longest phrases that occur at least twice, read straight off the LCP array.
+    Only left-maximal repeats are kept: a pair whose preceding symbols also
+    match is a shifted copy of a longer repeat, so it is skipped.
+    Returns [(length, [location, location]), ...], longest first.
+    """
+    s = index[stream]
+    text = s["text"]
+    order = np.argsort(-s["lcp"], kind="stable")
+    out, seen = [], set()
+
+    for r in order:
+        length = int(s["lcp"][r])
+        if length < min_len or len(out) >= top:
+            break
+        a, b = int(s["sa"][r - 1]), int(s["sa"][r])
+        if a > 0 and b > 0 and text[a - 1] == text[b - 1] != 0:
+            continue
+        key = (min(a, b), length)
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append((length, _format_hits(index, s, np.array([a, b]))))
+    return out
+
+
+# -----------------------------------------------------------
+# 6) CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the phrase search index.")
+    parser.add_argument("--build", action="store_true", help="(Re)build and save the index")
+    parser.add_argument("--query", nargs="+", help="Slot strings to search, e.g. ดํลซฟ ซฟดฟ")
+    parser.add_argument("--contour", action="store_true", help="Transposition-invariant search")
+    parser.add_argument("--index", default=str(DEFAULT_INDEX_PATH), help="Index file path")
+    args = parser.parse_args()
+
+    data_root = Path(__file__).parent.parent / "thai_music_data"
+
+    if args.build:
+        index = build_index(load_songs(data_root))
+        path = save_index(index, args.index)
+        print(f"✓ Indexed {len(index['songs'])} songs, "
+              f"{len(index['pitch']['text']):,} tokens → {path}")
+    else:
+        index = load_or_build_index(data_root, args.index)
+
+    if args.query:
+        hits = search_contour(index, args.query) if args.contour else search(index, args.query)
+        print(f"Found {len(hits)} occurrence(s) of {' '.join(args.query)}"
+              f"{' (contour)' if args.contour else ''}\n")
+        for h in hits:
+            print(f"  {h['motif']}/{h['song']}  §{h['section_idx']} {h['section']}"
+                  f"  bar {h['bar']}  slot {h['slot']}")
+
+
+if __name__ == "__main__":
+    main()
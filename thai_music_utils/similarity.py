@@ -0,0 +1,350 @@
+# similarity.py
+# -----------------------------------------------------------
+# Sparse n-gram profiles + all-pairs similarity
+# Units:
+# - songs, sections, motifs (or any labelled token list)
+# Features (TF-IDF over integer-hashed n-grams):
+# - pitch    : pitch/rest token n-grams
+# - interval : scale-step interval n-grams (pitch only)
+# - rest     : rhythm skeleton n-grams (note → N, rests kept)
+# -----------------------------------------------------------
+
+import numpy as np
+from scipy import sparse
+
+from .corpus import THAI_NOTES, REST_TOKENS, section_sequences, slots_to_tokens
+
+FEATURE_KINDS = ("pitch", "interval", "rest")
+
+# token → small integer alphabet: pitches 1..7, REST_1..4 → 8..11
+# (0 is never used, so n-grams of different lengths cannot collide)
+_ALPHABET = {tok: i + 1 for i, tok in enumerate(list(THAI_NOTES) + REST_TOKENS)}
+_N_PITCH = len(THAI_NOTES)
+
+_BITS = 4          # per symbol (alphabets are < 16)
+_MAX_ORDER = 5     # keeps the dense key space (3 × Σ 16^n) small
+
+
+# -----------------------------------------------------------
+# 1) Units
+# -----------------------------------------------------------
+def song_units(songs):
+    """One unit per song: label = (motif, song)."""
+    return [((s["motif"], s["song"]), s["pitch_sequence"]) for s in songs]
+
+
+def section_units(songs):
+    """One unit per section: label = (motif, song, section_idx, section_name)."""
+    units = []
+    for s in songs:
+        for si, (name, seq) in enumerate(section_sequences(s["data"])):
+            units.append(((s["motif"], s["song"], si, name), seq))
+    return units
+
+
+def motif_units(songs):
+    """One unit per motif: all songs of the motif concatenated."""
+    grouped = {}
+    for s in songs:
+        grouped.setdefault(s["motif"], []).append(s["pitch_sequence"])
+    # a REST_4 separator is cheaper than tracking boundaries per motif
+    return [
+        ((motif,), [tok for seq in seqs for tok in seq + ["<REST_4>"]])
+        for motif, seqs in grouped.items()
+    ]
+
+
+# -----------------------------------------------------------
+# 2) Token lists → integer symbol streams
+#    Every unit is concatenated into one stream; `owner` keeps the
+#    unit index of each symbol so windows crossing units are dropped.
+# -----------------------------------------------------------
+def _encode(token_lists):
+    lengths = [len(toks) for toks in token_lists]
+    ids = np.fromiter(
+        (_ALPHABET.get(t, 0) for toks in token_lists for t in toks),
+        dtype=np.int64, count=sum(lengths),
+    )
+    owner = np.repeat(np.arange(len(token_lists)), lengths)
+    keep = ids > 0
+    return ids[keep], owner[keep]
+
+
+def _symbol_stream(ids, owner, kind):
+    if kind == "pitch":
+        return ids, owner
+
+    if kind == "interval":
+        is_pitch = ids <= _N_PITCH
+        steps, step_owner = ids[is_pitch], owner[is_pitch]
+        same = step_owner[1:] == step_owner[:-1]
+        # scale steps -6..+6 → 1..13
+        return (np.diff(steps) + _N_PITCH)[same], step_owner[1:][same]
+
+    if kind == "rest":
+        # every pitch → 1, REST_k → k + 1
+        return np.where(ids <= _N_PITCH, 1, ids - _N_PITCH + 1), owner
+
+    raise ValueError(f"Unknown feature kind: {kind!r}")
+
+
+def _key_offsets(orders):
+    """Start of each (kind, n) block in the dense n-gram key space."""
+    offsets, total = {}, 0
+    for kind_idx in range(len(FEATURE_KINDS)):
+        for n in sorted(orders):
+            if not 1 <= n <= _MAX_ORDER:
+                raise ValueError(f"n-gram order must be in 1..{_MAX_ORDER}, got {n}")
+            offsets[kind_idx, n] = total
+            total += 1 << (_BITS * n)
+    return offsets, total
+
+
+def _ngram_keys(flat, owner, orders, kind_idx, offsets):
+    """
+    Pack every n-gram of the stream into one int64 key.
+    Codes for order n are extended from order n-1 in place, so the cost
+    is O(len(flat) × max(orders)) with no Python loop over positions.
+
+    Returns (unit_index, key) arrays.
+    """
+    rows, keys = [], []
+    code = np.zeros(len(flat) + 1, dtype=np.int64)[:-1]
+
+    for n in range(1, max(orders) + 1):
+        if len(flat) < n:
+            break
+        code = (code[: len(flat) - n + 1] << _BITS) | flat[n - 1:]
+        if n not in orders:
+            continue
+
+        # windows crossing a unit boundary are dropped
+        valid = owner[: len(code)] == owner[n - 1:]
+        rows.append(owner[: len(code)][valid])
+        keys.append(code[valid] + offsets[kind_idx, n])
+
+    return rows, keys
+
+
+def _count_matrix(token_lists, orders, kinds):
+    ids, owner = _encode(token_lists)
+    offsets, space = _key_offsets(orders)
+
+    rows, keys = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for kind_idx, kind in enumerate(FEATURE_KINDS):
+        if kind not in kinds:
+            continue
+        stream, stream_owner = _symbol_stream(ids, owner, kind)
+        r, k = _ngram_keys(stream, stream_owner, set(orders), kind_idx, offsets)
+        rows.extend(r)
+        keys.extend(k)
+
+    return np.concatenate(rows), np.concatenate(keys), space
+
+
+# -----------------------------------------------------------
+# 3) Build TF-IDF profiles
+# -----------------------------------------------------------
+def build_profiles(units, orders=(2, 3, 4), kinds=FEATURE_KINDS, sublinear_tf=True,
+                   max_df=1.0):
+    """
+    units:  list of (label, token_list), e.g. from song_units()
+    max_df: drop n-grams found in more than this fraction of units;
+            near-universal n-grams add little to cosine scores but
+            dominate the cost of the all-pairs product
+
+    Returns a profile dict:
+        matrix : CSR (n_units × n_features), L2-normalized TF-IDF rows
+        labels : unit labels in row order
+        keys   : sorted int64 n-gram keys (column order)
+        idf    : idf weight per column
+        orders, kinds, sublinear_tf
+    """
+    unknown = set(kinds) - set(FEATURE_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown feature kind(s): {sorted(unknown)}")
+
+    labels = [label for label, _ in units]
+    token_lists = [toks for _, toks in units]
+
+    rows, keys, space = _count_matrix(token_lists, orders, kinds)
+
+    # compress the dense key space to the n-grams actually seen
+    # (bincount + cumsum instead of a sort over every occurrence)
+    seen = np.bincount(keys, minlength=space) > 0
+    columns = np.flatnonzero(seen)
+    cols = (np.cumsum(seen) - 1)[keys]
+
+    counts = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float64), (rows, cols)),
+        shape=(len(units), len(columns)),
+    )
+    counts.sum_duplicates()
+
+    df = np.bincount(counts.indices, minlength=len(columns))
+    if max_df < 1.0:
+        keep = df <= max_df * len(units)
+        counts = counts[:, keep]
+        columns, df = columns[keep], df[keep]
+
+    # smooth idf (as in scikit-learn): log((1 + N) / (1 + df)) + 1
+    idf = np.log((1 + len(units)) / (1 + df)) + 1.0
+
+    profiles = {
+        "labels": labels,
+        "keys": columns,
+        "idf": idf,
+        "orders": tuple(orders),
+        "kinds": tuple(kinds),
+        "sublinear_tf": sublinear_tf,
+    }
+    profiles["matrix"] = _weight(counts, profiles)
+    return profiles
+
+
+def _weight(counts, profiles):
+    tf = counts.copy()
+    if profiles["sublinear_tf"]:
+        tf.data = 1.0 + np.log(tf.data)
+    tfidf = tf @ sparse.diags(profiles["idf"])
+    tfidf = sparse.csr_matrix(tfidf)
+
+    norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms) @ tfidf)
+
+
+def transform(profiles, token_lists):
+    """
+    Project new token lists into an existing profile space.
+    Unseen n-grams are dropped.
+    """
+    rows, keys, _ = _count_matrix(token_lists, profiles["orders"], profiles["kinds"])
+
+    cols = np.searchsorted(profiles["keys"], keys)
+    cols = np.minimum(cols, max(len(profiles["keys"]) - 1, 0))
+    known = profiles["keys"][cols] == keys if len(profiles["keys"]) else np.zeros(len(keys), bool)
+
+    counts = sparse.csr_matrix(
+        (np.ones(int(known.sum())), (rows[known], cols[known])),
+        shape=(len(token_lists), len(profiles["keys"])),
+    )
+    counts.sum_duplicates()
+    return _weight(counts, profiles)
+
+
+# -----------------------------------------------------------
+# 4) Similarity
+# -----------------------------------------------------------
+def _keep_top_k(block, k, diag_offset=None):
+    """
+    Zero all but the k largest entries of each row of a CSR block.
+    diag_offset: column of row 0's self-match, dropped first (None: keep)
+    """
+    for r in range(block.shape[0]):
+        start, end = block.indptr[r], block.indptr[r + 1]
+        vals = block.data[start:end]
+        if diag_offset is not None:
+            vals[block.indices[start:end] == diag_offset + r] = 0
+        if end - start > k:
+            vals[np.argpartition(-vals, k - 1)[k:]] = 0
+    block.eliminate_zeros()
+    return block
+
+
+def similarity_matrix(profiles, other=None, min_score=0.0, top_k=None, block_rows=2048):
+    """
+    All-pairs cosine similarity as sparse matrix products.
+
+    other:      optional second profile matrix (CSR) in the same space;
+                default compares profiles against themselves
+    min_score:  drop entries below this value to keep the result sparse
+    top_k:      keep only the k best columns of each row (self-matches
+                are dropped first when comparing profiles against
+                themselves), so the result holds at most n·k entries
+                instead of the near-dense n² of min_score=0
+    block_rows: rows per product block; each block is thresholded before
+                stacking so peak memory stays bounded for large corpora
+    """
+    A = profiles["matrix"]
+    BT = sparse.csr_matrix((A if other is None else other).T)
+
+    blocks = []
+    for start in range(0, A.shape[0], block_rows):
+        block = sparse.csr_matrix(A[start:start + block_rows] @ BT)
+        if min_score > 0:
+            block.data[block.data < min_score] = 0
+            block.eliminate_zeros()
+        if top_k is not None:
+            block = _keep_top_k(block, top_k, start if other is None else None)
+        blocks.append(block)
+
+    if not blocks:
+        return sparse.csr_matrix((0, BT.shape[1]))
+    return sparse.csr_matrix(sparse.vstack(blocks))
+
+
+def similarity_frame(profiles, sim=None):
+    """Dense pandas DataFrame of the similarity matrix (small unit sets only)."""
+    import pandas as pd
+
+    if sim is None:
+        sim = similarity_matrix(profiles)
+    index = [" / ".join(str(p) for p in label) for label in profiles["labels"]]
+    return pd.DataFrame(sim.toarray(), index=index, columns=index)
+
+
+def top_k(profiles, query, k=10, exclude=None):
+    """
+    Nearest units to a query fragment.
+
+    query:   list of slot strings (e.g. ["---ฟ", "-ฟฟฟ"]) or
+             an already-normalized token list
+    exclude: optional label, or predicate on labels, to skip
+             (e.g. lambda lab: lab[1] == "เขมรพวง" for the query's own song)
+
+    Returns [(label, score), ...] sorted by descending score.
+    """
+    tokens = query
+    if any(t not in _ALPHABET for t in query):
+        tokens = slots_to_tokens(query)
+
+    q = transform(profiles, [tokens])
+    scores = np.asarray((profiles["matrix"] @ q.T).todense()).ravel()
+
+    if exclude is not None:
+        skip = exclude if callable(exclude) else (lambda label: label == exclude)
+        for i, label in enumerate(profiles["labels"]):
+            if skip(label):
+                scores[i] = -np.inf
+
+    k = min(k, len(scores))
+    if k == 0:
+        return []
+    idx = np.argpartition(-scores, k - 1)[:k]
+    idx = idx[np.argsort(-scores[idx])]
+    return [(profiles["labels"][i], float(scores[i])) for i in idx if np.isfinite(scores[i])]
+
+
+def top_k_pairs(sim, k=5):
+    """
+    Row-wise top-k neighbours from a sparse similarity matrix,
+    ignoring the diagonal. Returns {row: [(col, score), ...]}.
+    similarity_matrix(profiles, top_k=k) already holds only these, so
+    the full matrix never needs to be built.
+    """
+    sim = sparse.csr_matrix(sim, copy=True)
+    if sim.shape[0] == sim.shape[1]:
+        sim.setdiag(0)
+        sim.eliminate_zeros()
+
+    out = {}
+    for r in range(sim.shape[0]):
+        start, end = sim.indptr[r], sim.indptr[r + 1]
+        cols, vals = sim.indices[start:end], sim.data[start:end]
+        if len(vals) > k:
+            keep = np.argpartition(-vals, k - 1)[:k]
+            cols, vals = cols[keep], vals[keep]
+        order = np.argsort(-vals)
+        out[r] = [(int(cols[i]), float(vals[i])) for i in order]
+    return out
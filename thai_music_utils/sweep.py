@@ -0,0 +1,504 @@
+# sweep.py
+# -----------------------------------------------------------
+# Adaptive hyperparameter sweeps with successive halving
+#
+# Instead of running every seed on every configuration, each rung runs a few
+# seeds per configuration. It then keeps only the configurations that are
+# still competitive on the target metric:
+# - a config is dropped when its confidence interval (across per-seed
+#   means) lies entirely on the wrong side of the best config's interval
+# - at most ceil(alive / eta) configs survive a rung
+# Survivors get eta × more seeds on the next rung, up to max_seeds.
+#
+# Every finished (config, seed) run is cached on disk by the hash of its
+# config and trial context (trial arguments + corpus hash), so
+# re-running or extending a sweep only computes what is missing. The trace
+# (per-rung estimates) and all raw rows (batch_eval_results layout) can be
+# exported for the existing sweep figures.
+#
+# Usage (n-gram α × n sweep, target pitch_kl):
+#   python3 -m thai_music_utils.sweep --motif เขมร --ref-song เขมรพวง \
+#       --songs เขมรพวง เขมรไทรโยค --metric pitch_kl
+#
+# Usage (LSTM temperature × seq_len sweep, registered models):
+#   python3 -m thai_music_utils.sweep --trial lstm --motif เขมร --ref-song เขมรพวง \
+#       --songs เขมรพวง เขมรไทรโยค --seq-lens 16 32 --metric corpus_overlap
+# -----------------------------------------------------------
+
+import argparse
+import hashlib
+import itertools
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from .eval_metrics import HIGHER_BETTER, METRIC_COLS
+from .model_registry import DEFAULT_WEIGHTS_DIR
+
+DEFAULT_SWEEP_DIR = Path(__file__).parent.parent / "outputs" / "sweeps"
+
+
+# -----------------------------------------------------------
+# 1) Grid + cache
+# -----------------------------------------------------------
+def expand_grid(grid):
+    """{"n": [2, 3], "alpha": [0.01, 0.1]} → list of config dicts (sorted keys)."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def _canonical(d):
+    return {k: (float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v)
+            for k, v in d.items()}
+
+
+def config_hash(config, context=None):
+    """
+    Stable short hash of a config dict (key order and int/float spelling
+    ignored). context: everything else that decides a run's rows (trial
+    arguments, corpus hash, …); part of the hash when given.
+    """
+    payload = _canonical(config)
+    if context is not None:
+        payload = {"config": payload, "context": _canonical(context)}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _cache_path(cache_dir, config, seed, context):
+    return Path(cache_dir) / f"{config_hash(config, context)}_{seed}.json"
+
+
+def _load_cached(cache_dir, config, seed, context):
+    path = _cache_path(cache_dir, config, seed, context)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["rows"]
+
+
+def _save_cached(cache_dir, config, seed, context, rows):
+    path = _cache_path(cache_dir, config, seed, context)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"config": config, "context": context, "seed": seed, "rows": rows},
+                  f, ensure_ascii=False)
+    tmp.replace(path)
+
+
+# -----------------------------------------------------------
+# 2) Statistics
+# -----------------------------------------------------------
+def seed_means(per_seed, metric):
+    """
+    One value per seed: the mean of `metric` over that seed's rows.
+    Rows of one seed share the seed, so they are not independent samples.
+    """
+    means = []
+    for rows in per_seed:
+        values = np.asarray([r[metric] for r in rows], dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values):
+            means.append(float(values.mean()))
+    return means
+
+
+def summarize_runs(values, z=1.96):
+    """(mean, ci_low, ci_high) over independent values (one per seed, see seed_means)."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return float("nan"), float("nan"), float("nan")
+    mean = float(values.mean())
+    if len(values) < 2:
+        return mean, -math.inf, math.inf
+    half = z * float(values.std(ddof=1)) / math.sqrt(len(values))
+    return mean, mean - half, mean + half
+
+
+def _survivors(stats, maximize, eta):
+    """Config hashes that stay in the race after one rung."""
+    ranked = sorted(stats, key=lambda h: stats[h][0], reverse=maximize)
+    ranked = [h for h in ranked if np.isfinite(stats[h][0])]
+    if not ranked:
+        return []
+
+    best_mean, best_lo, best_hi = stats[ranked[0]]
+    if maximize:
+        competitive = [h for h in ranked if stats[h][2] >= best_lo]
+    else:
+        competitive = [h for h in ranked if stats[h][1] <= best_hi]
+
+    return competitive[: max(1, math.ceil(len(ranked) / eta))]
+
+
+# -----------------------------------------------------------
+# 3) Scheduler
+# -----------------------------------------------------------
+def successive_halving(
+    configs,
+    run_fn,
+    metric,
+    maximize=None,
+    min_seeds=2,
+    max_seeds=16,
+    eta=2,
+    seeds=None,
+    cache_dir=None,
+    context=None,
+    workers=1,
+    z=1.96,
+    verbose=True,
+):
+    """
+    configs:  list of config dicts (see expand_grid)
+    run_fn:   callable(config, seed) → list of row dicts holding `metric`
+              (picklable, e.g. functools.partial of a module-level function,
+              when workers > 1)
+    metric:   target column, e.g. "pitch_kl"
+    maximize: default from the metric (HIGHER_BETTER)
+    seeds:    seed sequence to draw from (default 42, 43, …)
+    cache_dir: where finished runs are cached; needs `context`
+    context:  dict of everything besides config that decides run_fn's rows
+              (see ngram_context / lstm_context); cached runs are keyed
+              by config + context
+
+    Returns a result dict:
+        best      winning config
+        trace     list of per-rung rows (config, seeds, mean, CI, status)
+        rows      every run row (config columns + seed + metrics)
+        runs      number of (config, seed) runs computed or loaded
+        full_runs len(configs) × max_seeds, the fixed-budget cost
+    """
+    if maximize is None:
+        maximize = metric in HIGHER_BETTER
+    if seeds is None:
+        seeds = list(range(42, 42 + max_seeds))
+    if cache_dir is not None and context is None:
+        raise ValueError("cache_dir needs a context describing the trial (see ngram_context)")
+
+    by_hash = {config_hash(c): c for c in configs}
+    alive = list(by_hash)
+    done = {h: {} for h in alive}            # hash → {seed: rows}
+
+    trace, computed, loaded = [], 0, 0
+    n_seeds, rung = min(min_seeds, max_seeds), 0
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    try:
+        while True:
+            # run the missing (config, seed) pairs of this rung
+            todo = []
+            for h in alive:
+                for seed in seeds[:n_seeds]:
+                    if seed in done[h]:
+                        continue
+                    rows = _load_cached(cache_dir, by_hash[h], seed, context) if cache_dir else None
+                    if rows is not None:
+                        done[h][seed] = rows
+                        loaded += 1
+                    else:
+                        todo.append((h, seed))
+
+            results = (
+                pool.map(run_fn, [by_hash[h] for h, _ in todo], [s for _, s in todo])
+                if pool else (run_fn(by_hash[h], s) for h, s in todo)
+            )
+            for (h, seed), rows in zip(todo, results):
+                done[h][seed] = rows
+                computed += 1
+                if cache_dir:
+                    _save_cached(cache_dir, by_hash[h], seed, context, rows)
+
+            # estimate + prune
+            stats = {
+                h: summarize_runs(seed_means([done[h][s] for s in seeds[:n_seeds]], metric), z)
+                for h in alive
+            }
+            keep = set(_survivors(stats, maximize, eta)) if n_seeds < max_seeds else set(alive)
+
+            for h in alive:
+                mean, lo, hi = stats[h]
+                trace.append({
+                    "rung": rung, "config_hash": h, **by_hash[h], "seeds": n_seeds,
+                    "rows": sum(len(done[h][s]) for s in seeds[:n_seeds]),
+                    "mean": mean, "ci_low": lo, "ci_high": hi,
+                    "status": "alive" if h in keep else "eliminated",
+                })
+
+            if verbose:
+                print(f"rung {rung}: {len(alive)} config(s) × {n_seeds} seed(s) → {len(keep)} kept")
+
+            alive = [h for h in alive if h in keep]
+            if len(alive) <= 1 or n_seeds >= max_seeds:
+                break
+            n_seeds = min(n_seeds * eta, max_seeds)
+            rung += 1
+    finally:
+        if pool:
+            pool.shutdown()
+
+    final = {h: stats[h] for h in alive}
+    best = sorted(final, key=lambda h: final[h][0], reverse=maximize)[0] if final else None
+
+    rows = []
+    for h, per_seed in done.items():
+        for seed in sorted(per_seed):
+            rows.extend(per_seed[seed])
+
+    return {
+        "best": by_hash.get(best),
+        "metric": metric,
+        "maximize": maximize,
+        "trace": trace,
+        "rows": rows,
+        "runs": computed + loaded,
+        "computed": computed,
+        "full_runs": len(configs) * max_seeds,
+    }
+
+
+def export_sweep(result, out_dir):
+    """
+    Write trace.csv, runs.csv (batch_eval_results layout, usable by the
+    plot_sweep_* figure helpers) and best.json to out_dir.
+    """
+    import pandas as pd
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(result["trace"]).to_csv(out_dir / "trace.csv", index=False, encoding="utf-8-sig")
+    pd.DataFrame(result["rows"]).to_csv(out_dir / "runs.csv", index=False, encoding="utf-8-sig")
+    with open(out_dir / "best.json", "w", encoding="utf-8") as f:
+        json.dump({k: result[k] for k in ("best", "metric", "maximize", "runs", "computed", "full_runs")},
+                  f, ensure_ascii=False, indent=2)
+    return out_dir
+
+
+# -----------------------------------------------------------
+# 4) Built-in n-gram trial
+# -----------------------------------------------------------
+_state = {}
+
+
+def _ngram_setup(data_root, motif, n_max, metric_n):
+    key = (str(data_root), motif, n_max, metric_n)
+    if key not in _state:
+        from .corpus import load_songs
+        from .ngram_model import build_ngram_counts, ngram_set
+
+        songs = load_songs(data_root)
+        model = build_ngram_counts(songs, n_max=n_max, motif=motif)
+        _state[key] = (songs, model, ngram_set(model, metric_n))
+    return _state[key]
+
+
+def ngram_context(data_root, batch_songs, ref_song, metric_n=3, max_new_tokens=240, n_max=4):
+    """
+    Cache context of ngram_trial: its arguments plus the corpus hash, so
+    cached runs go stale when the songs, references or data change.
+    """
+    from .corpus import load_songs
+    from .phrase_index import corpus_hash
+
+    return {
+        "trial": "ngram",
+        "batch_songs": list(batch_songs),
+        "ref_song": ref_song,
+        "metric_n": metric_n,
+        "max_new_tokens": max_new_tokens,
+        "n_max": n_max,
+        "corpus_hash": corpus_hash(load_songs(data_root)),
+    }
+
+
+def ngram_trial(config, seed, data_root, batch_songs, ref_song, metric_n=3,
+                max_new_tokens=240, n_max=4):
+    """
+    One (config, seed) run of the n-gram batch evaluation: every section
+    seed of batch_songs, same rows as run_single_eval_ngram.
+    config keys: motif, n, alpha and optionally method.
+    """
+    from .eval_metrics import combine_slots, generation_metrics, section_seed
+    from .ngram_model import generate
+
+    songs, model, corpus_ngrams = _ngram_setup(data_root, config["motif"], n_max, metric_n)
+    by_name = {s["song"]: s for s in songs}
+    ref_tokens = by_name[ref_song]["pitch_sequence"] if ref_song in by_name else []
+
+    n, alpha = int(config["n"]), float(config["alpha"])
+    method = config.get("method", "laplace")
+
+    rows = []
+    for song_name in batch_songs:
+        song = by_name[song_name]
+        sections = song["data"].get("sections", [])
+        for sec_idx in range(len(sections)):
+            fragment = section_seed(song, sec_idx)
+            if not fragment:
+                continue
+            tokens = generate(model, fragment, n, max_new_tokens, alpha, method, seed=seed)
+            row = {
+                "song": song_name,
+                "section_idx": sec_idx,
+                "section_name": sections[sec_idx].get("name", str(sec_idx)),
+                **config,
+                "seed": seed,
+            }
+            row.update(generation_metrics(combine_slots(fragment, tokens, n - 1),
+                                          ref_tokens, corpus_ngrams, metric_n))
+            rows.append(row)
+    return rows
+
+
+# -----------------------------------------------------------
+# 5) Built-in LSTM trial
+# -----------------------------------------------------------
+def _lstm_setup(data_root, motif, seq_len, metric_n, weights_dir):
+    key = ("lstm", str(data_root), motif, seq_len, metric_n, str(weights_dir))
+    if key not in _state:
+        from .corpus import load_songs
+        from .model_registry import get_model
+        from .ngram_model import build_ngram_counts, ngram_set
+
+        songs = load_songs(data_root)
+        corpus_ngrams = ngram_set(build_ngram_counts(songs, n_max=metric_n, motif=motif), metric_n)
+        model, entry = get_model(motif=motif, seq_len=seq_len, weights_dir=weights_dir)
+        _state[key] = (songs, corpus_ngrams, model, entry)
+    return _state[key]
+
+
+def lstm_context(data_root, batch_songs, ref_song, motif, seq_lens, metric_n=3,
+                 max_new_tokens=240, context_len=16, weights_dir=DEFAULT_WEIGHTS_DIR):
+    """
+    Cache context of lstm_trial: its arguments, the corpus hash and the
+    sha1 of the registered model get_model picks for each seq_len, so
+    cached runs go stale when a newer checkpoint is registered.
+    """
+    from .corpus import load_songs
+    from .model_registry import find, load_manifest
+    from .phrase_index import corpus_hash
+
+    manifest = load_manifest(weights_dir)
+    models = {
+        str(seq_len): manifest["models"][find(manifest, motif=motif, seq_len=seq_len)]["sha1"]
+        for seq_len in seq_lens
+    }
+    return {
+        "trial": "lstm",
+        "batch_songs": list(batch_songs),
+        "ref_song": ref_song,
+        "metric_n": metric_n,
+        "max_new_tokens": max_new_tokens,
+        "context_len": context_len,
+        "models": models,
+        "corpus_hash": corpus_hash(load_songs(data_root)),
+    }
+
+
+def lstm_trial(config, seed, data_root, batch_songs, ref_song, metric_n=3,
+               max_new_tokens=240, context_len=16, weights_dir=DEFAULT_WEIGHTS_DIR):
+    """
+    One (config, seed) run of the LSTM batch evaluation: every section
+    seed of batch_songs, same rows as the notebooks' run_single_eval.
+    config keys: motif, seq_len (picks the registered model, newest
+    first) and temperature. context_len=16 feeds the last 16 ids as the
+    notebooks did, whatever the model's seq_len (see generate_sequence).
+    """
+    from .corpus import slots_to_tokens
+    from .eval_metrics import combine_slots, generation_metrics, section_seed
+    from .lstm_model import generate_sequence
+
+    seq_len, temperature = int(config["seq_len"]), float(config["temperature"])
+    songs, corpus_ngrams, model, entry = _lstm_setup(
+        data_root, config["motif"], seq_len, metric_n, weights_dir
+    )
+    vocab, token_to_id = entry["vocab"], entry["token_to_id"]
+    by_name = {s["song"]: s for s in songs}
+    ref_tokens = by_name[ref_song]["pitch_sequence"] if ref_song in by_name else []
+
+    rows = []
+    for song_name in batch_songs:
+        song = by_name[song_name]
+        sections = song["data"].get("sections", [])
+        for sec_idx in range(len(sections)):
+            fragment = section_seed(song, sec_idx)
+            ids = [token_to_id[t] for t in slots_to_tokens(fragment) if t in token_to_id]
+            if not ids:
+                continue
+            ids = ([token_to_id["<REST_1>"]] * (seq_len - len(ids)) + ids)[-seq_len:]
+            out = generate_sequence(model, ids, max_new_tokens, temperature,
+                                    seed=seed, context_len=context_len)
+            row = {
+                "song": song_name,
+                "section_idx": sec_idx,
+                "section_name": sections[sec_idx].get("name", str(sec_idx)),
+                **config,
+                "seed": seed,
+            }
+            row.update(generation_metrics(combine_slots(fragment, [vocab[i] for i in out], seq_len),
+                                          ref_tokens, corpus_ngrams, metric_n))
+            rows.append(row)
+    return rows
+
+
+# -----------------------------------------------------------
+# 6) CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Successive-halving n-gram / LSTM sweep.")
+    parser.add_argument("--trial", default="ngram", choices=("ngram", "lstm"))
+    parser.add_argument("--motif", required=True)
+    parser.add_argument("--ref-song", required=True)
+    parser.add_argument("--songs", nargs="+", required=True, help="Seed songs (batch_songs)")
+    parser.add_argument("--metric", default="pitch_kl", choices=METRIC_COLS)
+    parser.add_argument("--ns", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--alphas", type=float, nargs="+", default=[0.001, 0.01, 0.1, 1.0])
+    parser.add_argument("--temperatures", type=float, nargs="+", default=[0.8, 1.0, 1.1, 1.3])
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[16],
+                        help="LSTM seq_len values (one registered model each)")
+    parser.add_argument("--min-seeds", type=int, default=2)
+    parser.add_argument("--max-seeds", type=int, default=16)
+    parser.add_argument("--eta", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--name", default=None, help="Sweep folder under outputs/sweeps/")
+    args = parser.parse_args()
+
+    root = Path(__file__).parent.parent
+    name = args.name or f"{args.trial}_{args.motif}_{args.metric}"
+    sweep_dir = DEFAULT_SWEEP_DIR / name
+    data_root = str(root / "thai_music_data")
+
+    if args.trial == "ngram":
+        configs = expand_grid({"motif": [args.motif], "n": args.ns, "alpha": args.alphas})
+        trial_args = {"batch_songs": args.songs, "ref_song": args.ref_song,
+                      "n_max": max(max(args.ns), 3)}
+        run_fn = partial(ngram_trial, data_root=data_root, **trial_args)
+        context = ngram_context(data_root, **trial_args)
+    else:
+        configs = expand_grid({"motif": [args.motif], "seq_len": args.seq_lens,
+                               "temperature": args.temperatures})
+        trial_args = {"batch_songs": args.songs, "ref_song": args.ref_song}
+        run_fn = partial(lstm_trial, data_root=data_root, **trial_args)
+        context = lstm_context(data_root, motif=args.motif, seq_lens=args.seq_lens, **trial_args)
+
+    result = successive_halving(
+        configs, run_fn, args.metric, min_seeds=args.min_seeds, max_seeds=args.max_seeds,
+        eta=args.eta, cache_dir=DEFAULT_SWEEP_DIR / "cache",
+        context=context, workers=args.workers,
+    )
+    export_sweep(result, sweep_dir)
+
+    print(f"\n🏆 best: {result['best']}")
+    print(f"   runs: {result['runs']} of {result['full_runs']} for the full grid "
+          f"({result['runs'] / result['full_runs']:.0%}), {result['computed']} computed now")
+    print(f"💾 trace + runs → {sweep_dir}")
+
+
+if __name__ == "__main__":
+    main()
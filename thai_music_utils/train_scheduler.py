@@ -0,0 +1,421 @@
+# train_scheduler.py
+# -----------------------------------------------------------
+# Concurrent LSTM training of several (motif, seq_len, hyperparameter) jobs
+# on CPU cores
+#
+# The Stage 3 models are small, so one notebook training on all threads
+# wastes most of them. Here each job runs in its own worker process with a
+# torch thread limit (cores // workers), and all jobs finish in about the
+# time of the slowest one.
+# - corpus windows are built once in the parent and written as .npy;
+#   workers memory-map them read-only (shared page cache, no copies)
+# - per job: checkpoint.pt after every epoch, log.jsonl, final weights
+#   registered in the model registry (model_registry.py)
+# - interrupted jobs resume from their last checkpoint; finished jobs are
+#   skipped
+# - report.json: per-job and total throughput (windows / s), wall time
+#   and summed job time
+#
+# Training matches the notebooks (Adam, cross-entropy, unshuffled batches
+# of 64) unless a job overrides it.
+#
+# Usage:
+#   python3 -m thai_music_utils.train_scheduler \
+#       --job เขมร:16 --job เขมร:32 --job ลาว:16 --epochs 30
+#   python3 -m thai_music_utils.train_scheduler --job เขมร:16 --dedup-power 0.5
+# -----------------------------------------------------------
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from .bar_dictionary import training_windows, window_weights
+from .model_registry import DEFAULT_CONFIG, DEFAULT_WEIGHTS_DIR, register
+
+DEFAULT_RUN_DIR = Path(__file__).parent.parent / "outputs" / "training"
+
+JOB_DEFAULTS = {
+    "epochs": 30,
+    "batch_size": 64,
+    "lr": 0.001,
+    "seed": 42,
+    "shuffle": False,
+    "dedup_power": None,   # None: every window as in the notebooks
+    **DEFAULT_CONFIG,
+}
+
+
+def job_name(job):
+    # no epochs: rerunning with more epochs resumes the same job
+    name = f"lstm_{job['motif']}_{job['seq_len']}"
+    if job.get("dedup_power") is not None:
+        name += f"_dedup{job['dedup_power']:g}"
+    return name
+
+
+def make_job(motif, seq_len, **overrides):
+    """Job dict with notebook defaults filled in (and a default name)."""
+    job = {"motif": motif, "seq_len": int(seq_len), **JOB_DEFAULTS, **overrides}
+    job.setdefault("name", job_name(job))
+    return job
+
+
+def job_identity(job, corpus_hash):
+    """
+    What a checkpoint must share with a job to be resumed: every setting
+    but name and epochs (more epochs just continue training), plus the
+    corpus it was trained on. corpus_hash covers the song paths relative
+    to songs/ and their content only, so the same data read through
+    another data_root or checkout still matches. JSON-normalized so it
+    compares to job.json.
+    """
+    ident = {k: v for k, v in job.items() if k not in ("name", "epochs")}
+    return json.loads(json.dumps({**ident, "corpus_hash": corpus_hash}, ensure_ascii=False))
+
+
+def _read_json(path):
+    if not Path(path).exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# -----------------------------------------------------------
+# 1) Parent: shared corpus data
+# -----------------------------------------------------------
+def prepare_data(jobs, data_root, run_dir):
+    """
+    Write one windows file per distinct (motif, seq_len, dedup_power) under
+    run_dir/data/ and return {job name: data info} (paths, vocab, corpus
+    hash). The song corpus is read here only; workers never touch it.
+    """
+    from .corpus import build_vocab, load_songs
+    from .phrase_index import corpus_hash
+
+    data_dir = Path(run_dir) / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    by_motif, built, info = {}, {}, {}
+    for job in jobs:
+        motif = job["motif"]
+        if motif not in by_motif:
+            songs = load_songs(data_root, motif=motif)
+            if not songs:
+                raise ValueError(f"No songs for motif {motif!r}")
+            by_motif[motif] = (songs, build_vocab(songs), corpus_hash(songs))
+        songs, (vocab, token_to_id, _), chash = by_motif[motif]
+
+        key = (motif, job["seq_len"], job.get("dedup_power"))
+        if key not in built:
+            dedup = job.get("dedup_power") is not None
+            X, y, counts = training_windows(
+                [s["pitch_sequence"] for s in songs], token_to_id, job["seq_len"], dedup=dedup
+            )
+            stem = f"{motif}_{job['seq_len']}" + (f"_dedup{job['dedup_power']:g}" if dedup else "")
+            paths = {"X": str(data_dir / f"{stem}_X.npy"), "y": str(data_dir / f"{stem}_y.npy")}
+            np.save(paths["X"], X)
+            np.save(paths["y"], y)
+            if dedup:
+                paths["w"] = str(data_dir / f"{stem}_w.npy")
+                np.save(paths["w"], window_weights(counts, job["dedup_power"]))
+            built[key] = {"paths": paths, "windows": len(y), "raw_windows": int(counts.sum())}
+
+        info[job["name"]] = {**built[key], "vocab": vocab, "corpus_hash": chash}
+    return info
+
+
+# -----------------------------------------------------------
+# 2) Worker
+# -----------------------------------------------------------
+def _shared(path):
+    """Read-only memory-mapped tensor over a .npy file."""
+    import torch
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)    # non-writable array
+        return torch.from_numpy(np.load(path, mmap_mode="r"))
+
+
+def _save_atomic(obj, path):
+    import torch
+
+    tmp = Path(str(path) + ".tmp")
+    torch.save(obj, tmp)
+    tmp.replace(path)
+
+
+def train_job(job, data, job_dir, threads=1):
+    """
+    Train one job in this process (normally a pool worker). Resumes from
+    job_dir/checkpoint.pt when present. Returns a summary dict.
+    """
+    import torch
+    import torch.nn as nn
+
+    from .lstm_model import LSTMLanguageModel
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass        # already set in this process
+
+    job_dir = Path(job_dir)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    ckpt_path = job_dir / "checkpoint.pt"
+
+    X = _shared(data["paths"]["X"])
+    y = _shared(data["paths"]["y"])
+    w = _shared(data["paths"]["w"]) if "w" in data["paths"] else None
+
+    torch.manual_seed(job["seed"])
+    model = LSTMLanguageModel(
+        len(data["vocab"]),
+        embed_dim=job["embed_dim"],
+        hidden_dim=job["hidden_dim"],
+        num_layers=job["num_layers"],
+        dropout=job["dropout"],
+    )
+    optimizer = torch.optim.Adam(model.parameters(), lr=job["lr"])
+    criterion = nn.CrossEntropyLoss(reduction="none" if w is not None else "mean")
+
+    identity = job_identity(job, data["corpus_hash"])
+    start_epoch, resumed_from = 0, None
+    if ckpt_path.exists():
+        ckpt = torch.load(ckpt_path, map_location="cpu", weights_only=False)
+        if ckpt.get("identity") != identity:
+            raise ValueError(f"{ckpt_path} was trained with different settings; "
+                             "use another job name or delete the job folder")
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        torch.set_rng_state(ckpt["rng"])
+        start_epoch = resumed_from = ckpt["epoch"]
+        if start_epoch > job["epochs"]:
+            raise ValueError(f"{ckpt_path} is already at epoch {start_epoch} > {job['epochs']}; "
+                             "use another job name or delete the job folder")
+
+    n, bs = len(y), job["batch_size"]
+    seconds = 0.0
+
+    with open(job_dir / "log.jsonl", "a", encoding="utf-8") as log:
+        for epoch in range(start_epoch, job["epochs"]):
+            t0 = time.perf_counter()
+            model.train()
+
+            order = (
+                torch.from_numpy(np.random.default_rng(job["seed"] + epoch).permutation(n))
+                if job["shuffle"] else None
+            )
+            total_loss, batches = 0.0, 0
+            for i in range(0, n, bs):
+                idx = order[i:i + bs] if order is not None else slice(i, i + bs)
+                optimizer.zero_grad()
+                loss = criterion(model(X[idx]), y[idx])
+                if w is not None:
+                    loss = (loss * w[idx]).mean()
+                loss.backward()
+                optimizer.step()
+                total_loss += loss.item()
+                batches += 1
+
+            elapsed = time.perf_counter() - t0
+            seconds += elapsed
+            avg_loss = total_loss / max(1, batches)
+
+            _save_atomic({
+                "model": model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "rng": torch.get_rng_state(),
+                "epoch": epoch + 1,
+                "identity": identity,
+            }, ckpt_path)
+            log.write(json.dumps({
+                "epoch": epoch + 1,
+                "loss": avg_loss,
+                "perplexity": float(np.exp(avg_loss)),
+                "seconds": round(elapsed, 3),
+                "windows_per_s": round(n / elapsed, 1) if elapsed else None,
+            }) + "\n")
+            log.flush()
+
+    return {
+        "name": job["name"],
+        "epochs_run": job["epochs"] - start_epoch,
+        "resumed_from": resumed_from,
+        "windows": n,
+        "train_seconds": seconds,
+        "state_dict": model.state_dict(),
+    }
+
+
+def _run_job(job, data, job_dir, threads):
+    """Pool entry point: train, then save the final weights next to the checkpoint."""
+    result = train_job(job, data, job_dir, threads)
+    _save_atomic(result.pop("state_dict"), Path(job_dir) / "weights.pth")
+    return result
+
+
+# -----------------------------------------------------------
+# 3) Scheduler
+# -----------------------------------------------------------
+def run_jobs(jobs, data_root, run_dir=DEFAULT_RUN_DIR, workers=None, threads=None,
+             register_weights=True, weights_dir=DEFAULT_WEIGHTS_DIR):
+    """
+    Train all jobs concurrently.
+
+    workers: processes (default min(len(jobs), CPU cores))
+    threads: torch threads per process (default cores // workers)
+    register_weights: copy each finished model to weights_dir/<name>.pth
+                      and add it to the model registry manifest
+
+    Returns the report dict (also written to run_dir/report.json).
+    """
+    run_dir = Path(run_dir)
+    jobs = [job if "name" in job else make_job(**job) for job in jobs]
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate job names: {names}")
+
+    # a job folder is reused only by a job with the same settings (job.json);
+    # it is skipped only when it finished with the same number of epochs,
+    # and resumed when asked for more
+    data = prepare_data(jobs, data_root, run_dir)
+    todo = []
+    for job in jobs:
+        job_dir = run_dir / job["name"]
+        identity = job_identity(job, data[job["name"]]["corpus_hash"])
+        prev = _read_json(job_dir / "job.json")
+
+        if prev is None and ((job_dir / "checkpoint.pt").exists() or (job_dir / "done.json").exists()):
+            raise ValueError(f"{job_dir} holds a run without job.json; delete it or rename the job")
+        if prev is not None and prev["identity"] != identity:
+            changed = sorted(k for k in set(identity) | set(prev["identity"])
+                             if identity.get(k) != prev["identity"].get(k))
+            raise ValueError(f"{job['name']}: {job_dir} was trained with different {changed}; "
+                             "use another job name or delete the folder")
+        done = _read_json(job_dir / "done.json") if prev is not None else None
+        if done is not None and prev["epochs"] == job["epochs"]:
+            print(f"⏭️  {job['name']}: already finished")
+            continue
+        if done is not None and prev["epochs"] > job["epochs"]:
+            raise ValueError(f"{job['name']}: {job_dir} was already trained for {prev['epochs']} "
+                             "epochs; use another job name or delete the folder")
+
+        job_dir.mkdir(parents=True, exist_ok=True)
+        with open(job_dir / "job.json", "w", encoding="utf-8") as f:
+            json.dump({"job": job, "epochs": job["epochs"], "identity": identity},
+                      f, ensure_ascii=False, indent=2)
+        todo.append(job)
+
+    report = {"jobs": [], "wall_seconds": 0.0}
+    if todo:
+        cores = os.cpu_count() or 1
+        workers = workers or min(len(todo), cores)
+        threads = threads or max(1, cores // workers)
+        print(f"🚀 {len(todo)} job(s) on {workers} worker(s) × {threads} thread(s)")
+
+        t0 = time.perf_counter()
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = {
+                pool.submit(_run_job, job, data[job["name"]], run_dir / job["name"], threads): job
+                for job in todo
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ {job['name']}: {e!r} (rerun to resume)")
+                    report["jobs"].append({"name": job["name"], "error": repr(e)})
+                    continue
+
+                info = data[job["name"]]
+                result["windows_per_s"] = (
+                    result["windows"] * result["epochs_run"] / result["train_seconds"]
+                    if result["train_seconds"] else None
+                )
+                if register_weights:
+                    import shutil
+
+                    target = Path(weights_dir) / f"{job['name']}.pth"
+                    shutil.copyfile(run_dir / job["name"] / "weights.pth", target)
+                    config = {k: job[k] for k in DEFAULT_CONFIG}
+                    register(target, info["vocab"], job["motif"], job["seq_len"],
+                             name=job["name"], corpus_hash=info["corpus_hash"], config=config,
+                             weights_dir=weights_dir, epochs=job["epochs"],
+                             dedup_power=job.get("dedup_power"))
+
+                with open(run_dir / job["name"] / "done.json", "w", encoding="utf-8") as f:
+                    json.dump({"job": job, **result}, f, ensure_ascii=False, indent=2)
+                report["jobs"].append(result)
+                print(f"✅ {job['name']}: {result['epochs_run']} epoch(s) in "
+                      f"{result['train_seconds']:.1f}s ({result['windows_per_s'] or 0:.0f} windows/s)")
+
+        report["wall_seconds"] = time.perf_counter() - t0
+
+    # job_seconds are measured while jobs share the cores, so their sum is
+    # not a serial baseline; concurrency = average number of jobs running
+    done = [r for r in report["jobs"] if "error" not in r]
+    report["summed_job_seconds"] = sum(r["train_seconds"] for r in done)
+    report["total_windows"] = sum(r["windows"] * r["epochs_run"] for r in done)
+    if done and report["wall_seconds"]:
+        report["windows_per_s"] = report["total_windows"] / report["wall_seconds"]
+        report["concurrency"] = report["summed_job_seconds"] / report["wall_seconds"]
+
+    run_dir.mkdir(parents=True, exist_ok=True)
+    with open(run_dir / "report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+# -----------------------------------------------------------
+# 4) CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent multi-motif LSTM training.")
+    parser.add_argument("--job", action="append", required=True, metavar="MOTIF:SEQ_LEN",
+                        help="Repeatable, e.g. --job เขมร:16 --job ลาว:16")
+    parser.add_argument("--epochs", type=int, default=JOB_DEFAULTS["epochs"])
+    parser.add_argument("--batch-size", type=int, default=JOB_DEFAULTS["batch_size"])
+    parser.add_argument("--lr", type=float, default=JOB_DEFAULTS["lr"])
+    parser.add_argument("--seed", type=int, default=JOB_DEFAULTS["seed"])
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--dedup-power", type=float, default=None,
+                        help="Train on distinct windows weighted counts ** power")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker")
+    parser.add_argument("--run-dir", default=str(DEFAULT_RUN_DIR))
+    parser.add_argument("--no-register", action="store_true")
+    args = parser.parse_args()
+
+    jobs = []
+    for spec in args.job:
+        motif, _, seq_len = spec.rpartition(":")
+        if not motif or not seq_len.isdigit():
+            parser.error(f"--job expects MOTIF:SEQ_LEN, got {spec!r}")
+        jobs.append(make_job(
+            motif, int(seq_len), epochs=args.epochs, batch_size=args.batch_size,
+            lr=args.lr, seed=args.seed, shuffle=args.shuffle, dedup_power=args.dedup_power,
+        ))
+
+    root = Path(__file__).parent.parent
+    report = run_jobs(jobs, root / "thai_music_data", args.run_dir, args.workers,
+                      args.threads, register_weights=not args.no_register)
+
+    if report.get("concurrency"):
+        print(f"\n⏱️  wall {report['wall_seconds']:.1f}s, summed job time "
+              f"{report['summed_job_seconds']:.1f}s (concurrency ×{report['concurrency']:.2f}), "
+              f"{report['windows_per_s']:.0f} windows/s total")
+    print(f"💾 {Path(args.run_dir) / 'report.json'}")
+
+
+if __name__ == "__main__":
+    main()